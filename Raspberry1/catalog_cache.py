@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+class CatalogCache:
+    """
+    The terminal's copy of the catalog, so a book scan is shown without
+    asking the server. Kept current from the server's retained snapshot and
+    deltas; a delta is only applied on top of the version it was made from,
+    anything else means we missed one and need a full sync.
+    Saved to disk so a restarted terminal can show books straight away; the
+    file is rewritten by a background thread, never on the MQTT thread.
+    """
+    def __init__(self, path=None, save_interval=5):
+        self.path = path
+        self.save_interval = save_interval
+        self.version = None
+        self.books = {}  # book_id -> {"id", "title", "author", "desc"}
+        self.lock = threading.Lock()
+        self.dirty = False  # Changed since the last save
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.load()
+
+    def __len__(self):
+        return len(self.books)
+
+    def get(self, book_id):
+        return self.books.get(book_id)
+
+    def apply_snapshot(self, data, force=False):
+        """force: a snapshot we asked for (trusted even if its version went backwards)"""
+        with self.lock:
+            if not force and self.version is not None and data["version"] < self.version:
+                return  # Older than what we have (e.g. a stale retained snapshot)
+            self.books = {b["id"]: b for b in data["books"]}
+            self.version = data["version"]
+            self.dirty = True
+
+    def apply_delta(self, data):
+        """False if the delta doesn't follow our version (caller should sync)"""
+        with self.lock:
+            if self.version is not None and data["version"] <= self.version and data["from"] != self.version:
+                return True  # Already covered by what we have
+            if data["from"] != self.version:
+                return False
+            for book in data["upsert"]:
+                self.books[book["id"]] = book
+            for book_id in data["delete"]:
+                self.books.pop(book_id, None)
+            self.version = data["version"]
+            self.dirty = True
+        return True
+
+    def is_current(self, version):
+        return self.version == version
+
+    # --- PERSISTENCE ---
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.books = {b["id"]: b for b in data["books"]}
+            self.version = data["version"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Catalog cache unreadable, waiting for the server: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = {"version": self.version, "books": list(self.books.values())}
+            self.dirty = False
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    # --- BACKGROUND SAVER ---
+    def start(self):
+        self.thread = threading.Thread(target=self._save_loop, name="catalog-save", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """Stops the saver and writes any pending change"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(5)
+        if self.dirty:
+            self.save()
+
+    def _save_loop(self):
+        while not self.stop_event.wait(self.save_interval):
+            if self.dirty:
+                try:
+                    self.save()
+                except OSError as e:
+                    print(f"Catalog cache save failed: {e}")
@@ -1,4 +1,8 @@
-import json
+import itertools
+import queue
+import threading
+import time
+import uuid
 import paho.mqtt.client as mqtt
 import sys
 import os
@@ -6,20 +10,63 @@ import os
 # Import Common Config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common import config
+from common import wire
+from outbox import Outbox
+from catalog_cache import CatalogCache
+
+# Requests that change data: kept in the outbox until the broker has them.
+# Logout goes the same way, so it can never overtake a borrow/return still queued for that session.
+DURABLE_ACTIONS = ("borrow", "return", "logout")
 
 class ClientController:
     def __init__(self, app):
         self.app = app
         self.current_user = ""
         self.current_role = "client"
+        self.session_token = None  # Issued by the server at login
         self.pending_action = None
+        # Correlation IDs sent during this session; replies to anything else are stale.
+        # The per-boot prefix keeps them unique across restarts (the outbox replays old ones).
+        self.corr_prefix = uuid.uuid4().hex[:8]
+        self.corr_ids = itertools.count(1)
+        self.session_requests = set()
+        # Outbox requests keep theirs across a logout: their answer is still shown when it arrives
+        self.queued_requests = set()
+        self.wire_format = wire.client_format()
+        # Filled by the MQTT thread, drained by the Tk thread once per frame
+        self.inbox = queue.SimpleQueue()
+        self.latest_book = None
+        self.streams = {}  # corr_id -> {"seq": next expected, "text": shown so far} for replies still streaming
+        # Durable requests: written to disk first, deleted once the broker acknowledges them
+        self.outbox = Outbox(config.OUTBOX_PATH)
+        self.outbox_wakeup = threading.Event()  # Set on a new request or a reconnect
+        self.connected = False
+        # Local catalog: book scans are shown from here, without a round trip
+        self.catalog = CatalogCache(config.CATALOG_CACHE_FILE, config.CATALOG_SAVE_INTERVAL)
+        self.catalog.start()
 
         # --- MQTT SETUP ---
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        # Persistent session: the broker keeps our QoS 1 replies while we're offline
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                                  client_id=f"terminal-{config.TERMINAL_ID}", clean_session=False)
+        self.client.on_connect = self.on_mqtt_connect
+        self.client.on_disconnect = self.on_mqtt_disconnect
         self.client.on_message = self.on_mqtt_message
-        self.client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
-        self.client.subscribe(config.TOPIC_DISPLAY)
+        # paho doubles the retry delay after each failed attempt, up to the max
+        self.client.reconnect_delay_set(config.MQTT_RECONNECT_MIN, config.MQTT_RECONNECT_MAX)
+        # Async: the terminal starts (and queues requests) even if the broker is down
+        self.client.connect_async(config.MQTT_BROKER, config.MQTT_PORT, 60)
         self.client.loop_start()
+        threading.Thread(target=self._outbox_loop, name="outbox", daemon=True).start()
+        self.app.after(config.UI_FRAME_MS, self.drain_inbox)
+
+    def close(self):
+        """Called when the window closes: disconnect, then save what is only in memory"""
+        self.connected = False  # Stops the outbox thread before its DB is closed
+        self.client.disconnect()
+        self.client.loop_stop()
+        self.catalog.close()
+        self.outbox.close()
 
     # --- ACTIONS (Called by UI) ---
     def handle_scan(self, card_id):
@@ -37,7 +84,16 @@ class ClientController:
                 "book_id": card_id 
             })
             self.pending_action = None
+            return
+
+        book = self.catalog.get(card_id)
+        if book:
+            # Known book: show it now; the server only records the view
+            self.app.update_book_info({**book, "reason": "Scanned Book"})
+            if self.session_token:
+                self.publish({"action": "view", "book_id": card_id})
         else:
+            # User card (login) or a book we don't know yet
             self.publish({"action": "scan", "id": card_id})
 
     def simulate_scan(self, card_id):
@@ -63,44 +119,209 @@ class ClientController:
         
         self.current_user = ""
         self.current_role = "client"
+        self.session_token = None
+        self.session_requests.clear()  # Late AI replies for the old user are ignored
+        self.latest_book = None
+        self.streams.clear()
         self.app.reset_ui() 
 
     def request_logs(self):
+        """Newest page; as admin the server then pushes new rows as they happen"""
         self.publish({"action": "get_logs"})
 
+    def request_older_logs(self, cursor):
+        """The page just older than cursor ([timestamp, id] of the oldest row shown)"""
+        self.publish({"action": "get_logs", "before": cursor})
+
+    def request_newer_logs(self, cursor):
+        """The page just newer than cursor (after the newest rows were dropped from the table)"""
+        self.publish({"action": "get_logs", "after": cursor})
+
     def publish(self, payload):
-        self.client.publish(config.TOPIC_SCAN, json.dumps(payload))
+        corr_id = f"{self.corr_prefix}-{next(self.corr_ids)}"
+        self.session_requests.add(corr_id)
+        payload["terminal"] = config.TERMINAL_ID
+        payload["corr_id"] = corr_id
+        if self.session_token:
+            payload["token"] = self.session_token
+        topic = wire.request_topic(self.wire_format)
+
+        if payload.get("action") not in DURABLE_ACTIONS:
+            self.client.publish(topic, wire.encode(payload, self.wire_format), qos=1)
+            return
+        # The server skips any msg_id it has already handled, so replays are safe.
+        # "queued" lets it accept the request even if the session has ended by the time it arrives.
+        if payload["action"] != "logout":  # The only one the server doesn't answer
+            self.queued_requests.add(corr_id)
+        payload["msg_id"] = f"{config.TERMINAL_ID}-{uuid.uuid4().hex}"
+        payload["queued"] = time.time()
+        self.outbox.add(payload["msg_id"], topic, wire.encode(payload, self.wire_format))
+        self.outbox_wakeup.set()
+
+    def _outbox_loop(self):
+        """Sends queued requests oldest first, a batch at a time, while the broker is reachable"""
+        while True:
+            self.outbox_wakeup.wait()
+            self.outbox_wakeup.clear()
+            while self.connected:
+                batch = self.outbox.pending(config.OUTBOX_BATCH)
+                if not batch:
+                    break
+                sent = [(msg_id, self.client.publish(topic, raw, qos=1)) for msg_id, topic, raw in batch]
+                if not self._wait_acked(sent):
+                    break  # Connection dropped: the rest go out again after the reconnect
+
+    def _wait_acked(self, sent):
+        """Deletes each request once its PUBACK is in; False if the connection drops first"""
+        for msg_id, info in sent:
+            try:
+                while not info.is_published():
+                    if not self.connected:
+                        return False
+                    info.wait_for_publish(1)
+            except (RuntimeError, ValueError) as e:
+                print(f"Outbox publish failed: {e}")
+                return False
+            self.outbox.remove(msg_id)
+        return True
 
     # --- MQTT HANDLING ---
+    def on_mqtt_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            print(f"MQTT connect failed: {reason_code}")
+            return
+        self.connected = True
+        # Our own replies + true broadcasts (again after every reconnect)
+        client.subscribe(config.reply_topic(config.TERMINAL_ID), qos=1)
+        client.subscribe(config.TOPIC_DISPLAY, qos=1)
+        client.subscribe(config.TOPIC_CATALOG, qos=1)
+        client.subscribe(config.TOPIC_CATALOG_DELTA, qos=1)
+        backlog = len(self.outbox)
+        if backlog:
+            print(f"Broker connected: replaying {backlog} queued request(s)")
+        # Anything unacknowledged from before the drop is sent again (server dedups by msg_id)
+        self.outbox_wakeup.set()
+
+    def on_mqtt_disconnect(self, client, userdata, flags, reason_code, properties):
+        self.connected = False
+        print(f"Broker connection lost ({reason_code}), retrying...")
+
     def on_mqtt_message(self, client, userdata, msg):
         try:
-            payload = json.loads(msg.payload.decode())
-            self.app.after(0, lambda: self.process_response(payload))
+            payload = wire.decode(msg.payload)
+            if payload.get("type") in ("catalog_snapshot", "catalog_delta"):
+                self.on_catalog_message(payload)  # Cache only, no UI work
+                return
+            corr_id = payload.get("corr_id")
+            if corr_id is not None and corr_id not in self.session_requests and corr_id not in self.queued_requests:
+                return  # Reply to a request from a previous session
+            self.inbox.put(payload)  # No Tk calls here: this is paho's thread
         except Exception as e:
             print(f"MQTT Error: {e}")
 
+    def on_catalog_message(self, data):
+        if data["type"] == "catalog_snapshot":
+            # A reply to our catalog_sync carries a corr_id; the retained broadcast doesn't
+            self.catalog.apply_snapshot(data, force=data.get("corr_id") is not None)
+        elif not self.catalog.apply_delta(data):
+            self.request_catalog_sync()
+
+    def request_catalog_sync(self):
+        """Missed a catalog change: ask for the full snapshot (sent to us only)"""
+        self.publish({"action": "catalog_sync"})
+
+    def drain_inbox(self):
+        """Applies everything that arrived since the last frame, then reschedules itself"""
+        try:
+            while True:
+                try:
+                    data = self.inbox.get_nowait()
+                except queue.Empty:
+                    break
+                if not self.is_for_us(data):
+                    continue
+                try:
+                    self.process_response(data)
+                except Exception as e:
+                    print(f"UI Error: {e}")
+
+            # A burst of recommendations only repaints the book panel once, with the newest
+            if self.latest_book is not None:
+                self.app.update_book_info(self.latest_book)
+                self.latest_book = None
+        finally:
+            self.app.after(config.UI_FRAME_MS, self.drain_inbox)
+
+    def is_for_us(self, data):
+        """Broadcast replies about someone else (or a stray login) are skipped"""
+        user = data.get("user")
+        if data.get("corr_id") is None and data.get("type") == "login":
+            return False  # Someone else's login on the broadcast topic
+        return not (user and self.current_user and user != self.current_user)
+
     def process_response(self, data):
         msg_type = data.get('type')
 
         if data.get('status') == 'error':
+            self.queued_requests.discard(data.get('corr_id'))
             self.app.show_error(data['message'])
+            if data.get('code') == 'SESSION_EXPIRED' and data.get('corr_id') in self.session_requests:
+                self.logout()  # Not for an outbox reply from an earlier session
             return
 
         if msg_type == 'action_confirm':
+            self.queued_requests.discard(data.get('corr_id'))
             self.app.show_success(data['message'])
 
         elif msg_type == 'log_data':
-            self.app.update_logs(data['logs'])
+            if data.get('before'):
+                self.app.append_older_logs(data['logs'], data.get('more', False))
+            elif data.get('after'):
+                self.app.prepend_newer_logs(data['logs'], data.get('more', False))
+            else:
+                self.app.update_logs(data['logs'], data.get('more', False))
+
+        elif msg_type == 'log_delta':
+            self.app.add_new_logs(data['logs'])
 
         elif msg_type == 'login':
             self.current_user = data['user']
             self.current_role = data.get('role', 'client')
+            self.session_token = data.get('token')
+            if 'catalog_version' in data and not self.catalog.is_current(data['catalog_version']):
+                self.request_catalog_sync()
             self.app.login_success(self.current_user, self.current_role)
-            self.app.update_book_info(data['book'])
+            self.latest_book = data['book']
             
             if self.current_role == "admin":
                 self.request_logs()
 
+        elif msg_type == 'chat_chunk':
+            self.on_chat_chunk(data)
+
         elif msg_type == 'chat_response':
-            self.app.update_book_info(data['book'])
-            self.app.add_chat_message("AI", data['book'].get('reason', ''), "ai_msg")
\ No newline at end of file
+            self.latest_book = data['book']
+            reason = data['book'].get('reason', '')
+            stream = self.streams.pop(data.get('corr_id'), None)
+            if stream is None:
+                self.app.add_chat_message("AI", reason, "ai_msg")
+            else:
+                # The complete reason replaces whatever part of the stream we showed
+                self.app.append_chat_message(data['corr_id'], reason, "ai_msg", final=True)
+
+    def on_chat_chunk(self, data):
+        """Part of an AI reply: grows one chat message (and the book panel) as it arrives"""
+        corr_id = data.get('corr_id')
+        stream = self.streams.get(corr_id)
+        if stream is None:
+            if data['seq'] != 0:
+                return  # Missed the start; the final chat_response shows it whole
+            stream = self.streams[corr_id] = {"seq": 0, "text": "", "book": data['book']}
+            self.app.add_chat_message("AI", data['text'], "ai_msg", stream=corr_id)
+        elif data['seq'] != stream['seq']:
+            return  # Duplicate (QoS 1) or gap; the final chat_response fixes the text
+        else:
+            self.app.append_chat_message(corr_id, data['text'], "ai_msg")
+        stream['seq'] += 1
+        stream['text'] += data['text']
+        self.latest_book = {**stream['book'], "reason": stream['text']}
\ No newline at end of file
@@ -1,5 +1,13 @@
+import csv
+import queue
 import threading
 import time
+from collections import namedtuple
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import config
 
 # Check if we are on a Raspberry Pi
 try:
@@ -9,32 +17,132 @@ try:
 except ImportError:
     IS_PI = False
 
+# One accepted scan; timestamp is when the card was read, not when it was handled
+ScanEvent = namedtuple("ScanEvent", "card_id timestamp")
+
+# --- BACKENDS ---
+# A source only needs poll(): the card ID in front of the reader right now, or None.
+class MFRC522Source:
+    """The real reader, polled without blocking (no card -> None straight away)"""
+    def __init__(self):
+        self.reader = SimpleMFRC522()
+
+    def poll(self):
+        card_id = self.reader.read_id_no_block()
+        return str(card_id) if card_id else None
+
+class SimulatedSource:
+    """Cards pushed in by code (tests, dev buttons)"""
+    def __init__(self):
+        self.cards = queue.SimpleQueue()
+
+    def inject(self, card_id):
+        self.cards.put(str(card_id))
+
+    def poll(self):
+        try:
+            return self.cards.get_nowait()
+        except queue.Empty:
+            return None
+
+class ReplaySource:
+    """
+    Plays back a recorded session: CSV rows of (seconds since start, card_id).
+    Repeat a card at short intervals to reproduce a card held on the reader.
+    """
+    def __init__(self, rows, loop=False):
+        self.rows = sorted((float(offset), str(card_id)) for offset, card_id in rows)
+        self.loop = loop
+        self.started = None
+        self.index = 0
+
+    @classmethod
+    def from_file(cls, path, loop=False):
+        with open(path, newline="") as f:
+            return cls([row for row in csv.reader(f) if row and not row[0].startswith("#")], loop)
+
+    def poll(self):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        if self.index >= len(self.rows):
+            if not self.loop or not self.rows:
+                return None
+            self.index, self.started = 0, now
+        offset, card_id = self.rows[self.index]
+        if now - self.started < offset:
+            return None
+        self.index += 1
+        return card_id
+
+def default_source():
+    """RFID_BACKEND: auto (real reader on a Pi), mfrc522, replay, or none"""
+    backend = config.RFID_BACKEND
+    if backend == "replay":
+        return ReplaySource.from_file(config.RFID_REPLAY_FILE)
+    if backend == "mfrc522" or (backend == "auto" and IS_PI):
+        return MFRC522Source()
+    return None  # On PC, simulation is manual buttons
+
+# --- READER LOOP ---
 class RFIDReader:
-    def __init__(self, callback_function):
+    """
+    Polls the source every poll_interval and queues each new card as a
+    ScanEvent. A card is ignored while it was already seen within the last
+    'debounce' seconds (so one held on the reader fires once), but a
+    different card is accepted immediately.
+    """
+    def __init__(self, callback_function, source=None, debounce=None, poll_interval=None):
         """
         :param callback_function: The function to call when a card is scanned.
         """
         self.callback = callback_function
+        self.source = source if source is not None else default_source()
+        self.debounce = config.RFID_DEBOUNCE if debounce is None else debounce
+        self.poll_interval = config.RFID_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.events = queue.Queue()
+        self.last_seen = {}  # card_id -> monotonic time it was last in front of the reader
         self.running = True
-        if IS_PI:
-            self.reader = SimpleMFRC522()
 
     def start(self):
-        """Starts the background listening thread."""
-        thread = threading.Thread(target=self._scan_loop, daemon=True)
-        thread.start()
+        """Starts the polling and dispatch threads (nothing to do without a source)."""
+        if self.source is None:
+            return
+        threading.Thread(target=self._poll_loop, name="rfid-poll", daemon=True).start()
+        threading.Thread(target=self._dispatch_loop, name="rfid-dispatch", daemon=True).start()
 
-    def _scan_loop(self):
+    def stop(self):
+        self.running = False
+        self.events.put(None)
+
+    def accept(self, card_id, now):
+        """Debounce check; refreshes the card's window either way"""
+        previous = self.last_seen.get(card_id)
+        self.last_seen[card_id] = now
+        if len(self.last_seen) > 64:
+            # Forget cards that left the reader long ago
+            self.last_seen = {c: t for c, t in self.last_seen.items() if now - t < self.debounce}
+        return previous is None or now - previous >= self.debounce
+
+    def _poll_loop(self):
         while self.running:
-            if IS_PI:
-                try:
-                    # Blocking call on the Pi
-                    id, text = self.reader.read()
-                    self.callback(str(id))
-                    time.sleep(2) # Prevent double scanning
-                except Exception as e:
-                    print(f"Hardware Error: {e}")
-                    time.sleep(1)
-            else:
-                # On PC, we do nothing loop (simulation is manual buttons)
-                time.sleep(1)
\ No newline at end of file
+            try:
+                card_id = self.source.poll()
+            except Exception as e:
+                print(f"Hardware Error: {e}")
+                time.sleep(1)
+                continue
+            if card_id and self.accept(card_id, time.monotonic()):
+                self.events.put(ScanEvent(card_id, time.time()))
+            time.sleep(self.poll_interval)
+
+    def _dispatch_loop(self):
+        # Separate thread: a slow callback never delays reading the next card
+        while True:
+            event = self.events.get()
+            if event is None:
+                break
+            try:
+                self.callback(event.card_id)
+            except Exception as e:
+                print(f"Scan Handler Error: {e}")
@@ -9,6 +9,7 @@ class SmartLibraryApp(tk.Tk):
         super().__init__()
         self.title("Smart Library Terminal")
         self.scan_popup = None
+        self.active_frame = None
         
         # 1. INIT CONTROLLER
         # We pass 'self' so the controller can call methods like 'reset_ui'
@@ -32,24 +33,28 @@ class SmartLibraryApp(tk.Tk):
         self.center_window()
 
         # 3. INIT HARDWARE
-        # Hardware calls controller directly
-        self.rfid = RFIDReader(callback_function=self.ctrl.handle_scan)
+        # Scans arrive on the reader's thread; handle them on the Tk thread
+        self.rfid = RFIDReader(callback_function=lambda card_id: self.after(0, self.ctrl.handle_scan, card_id))
         self.rfid.start()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_close(self):
+        self.rfid.stop()
+        self.ctrl.close()
+        self.destroy()
 
     # --- UI HELPERS (Called by Controller) ---
     def show_frame(self, page_name):
+        self.active_frame = page_name
         self.frames[page_name].tkraise()
 
     def login_success(self, user, role):
-        # Update User Label on both views
-        self.frames["DashboardView"].update_user(user)
-        self.frames["AdminView"].update_user(user)
-        
-        # Switch View
+        # Switch View, then label only the one that's visible
         if role == "admin":
             self.show_frame("AdminView")
         else:
             self.show_frame("DashboardView")
+        self.frames[self.active_frame].update_user(user)
 
     def reset_ui(self):
         # Clear Chats
@@ -57,18 +62,38 @@ class SmartLibraryApp(tk.Tk):
         self.frames["AdminView"].clear_chat()
         self.show_frame("LoginView")
 
+    def logged_in_view(self):
+        """The dashboard being shown (None on the login screen)"""
+        if self.active_frame in ("DashboardView", "AdminView"):
+            return self.frames[self.active_frame]
+        return None
+
     def update_book_info(self, book_data):
-        # Update both views just to be safe
-        self.frames["DashboardView"].update_book(book_data)
-        self.frames["AdminView"].update_book(book_data)
+        view = self.logged_in_view()
+        if view:
+            view.update_book(book_data)
+
+    def add_chat_message(self, sender, text, tag, stream=None):
+        view = self.logged_in_view()
+        if view:
+            view.add_chat_msg(sender, text, tag, stream)
+
+    def append_chat_message(self, stream, text, tag, final=False):
+        view = self.logged_in_view()
+        if view:
+            view.append_chat_msg(stream, text, tag, final)
+
+    def update_logs(self, logs, more=False):
+        self.frames["AdminView"].update_logs(logs, more)
+
+    def append_older_logs(self, logs, more):
+        self.frames["AdminView"].append_older_logs(logs, more)
 
-    def add_chat_message(self, sender, text, tag):
-        # Add to currently visible view (or both)
-        self.frames["DashboardView"].add_chat_msg(sender, text, tag)
-        self.frames["AdminView"].add_chat_msg(sender, text, tag)
+    def prepend_newer_logs(self, logs, more):
+        self.frames["AdminView"].prepend_newer_logs(logs, more)
 
-    def update_logs(self, logs):
-        self.frames["AdminView"].update_logs(logs)
+    def add_new_logs(self, logs):
+        self.frames["AdminView"].add_new_logs(logs)
 
     def show_scan_popup(self, action_type):
         # Pass controller to popup so simulation buttons work
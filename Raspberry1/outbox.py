@@ -0,0 +1,54 @@
+import sqlite3
+import threading
+import time
+
+class Outbox:
+    """
+    Requests that must reach the server (borrow/return/logout), kept in SQLite
+    until the broker acknowledges them (QoS 1 PUBACK). Survives broker
+    outages and terminal restarts; entries are replayed oldest first.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)  # Tk thread adds, paho thread removes
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    msg_id TEXT PRIMARY KEY,
+                    topic TEXT,
+                    payload BLOB,
+                    created REAL
+                )
+            """)
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def add(self, msg_id, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outbox (msg_id, topic, payload, created) VALUES (?, ?, ?, ?)",
+                (msg_id, topic, payload, time.time())
+            )
+            self.conn.commit()
+
+    def remove(self, msg_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM outbox WHERE msg_id=?", (msg_id,))
+            self.conn.commit()
+
+    def pending(self, limit):
+        """Oldest unacknowledged entries as (msg_id, topic, payload)"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT msg_id, topic, payload FROM outbox ORDER BY created, rowid LIMIT ?", (limit,)
+            ).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,5 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import config
 
 # --- STYLES & FONTS ---
 BG_DARK = "#2C3E50"
@@ -107,9 +112,31 @@ class DashboardView(tk.Frame):
         self.lbl_desc.config(text=book['desc'])
         self.lbl_reason.config(text=f"AI Insight: {book.get('reason', '')}")
 
-    def add_chat_msg(self, sender, text, tag):
+    def add_chat_msg(self, sender, text, tag, stream=None):
+        """stream: ID of a reply still arriving; append_chat_msg adds to this message later"""
+        self.chat_history.config(state='normal')
+        self.chat_history.insert(tk.END, f"{sender}: ", tag)
+        if stream is not None:
+            # Marks around the message text: left gravity stays put, right gravity grows with it
+            self.chat_history.mark_set(f"stream_{stream}_start", "end-1c")
+            self.chat_history.mark_gravity(f"stream_{stream}_start", tk.LEFT)
+        self.chat_history.insert(tk.END, f"{text}\n", tag)
+        if stream is not None:
+            self.chat_history.mark_set(f"stream_{stream}_end", "end-2c")
+        self.chat_history.see(tk.END)
+        self.chat_history.config(state='disabled')
+
+    def append_chat_msg(self, stream, text, tag, final=False):
+        """Adds text to a streamed message; final=True replaces it with the complete text and closes it"""
+        start, end = f"stream_{stream}_start", f"stream_{stream}_end"
+        if end not in self.chat_history.mark_names():
+            return  # Chat was cleared (logout) while the reply was streaming
         self.chat_history.config(state='normal')
-        self.chat_history.insert(tk.END, f"{sender}: {text}\n", tag)
+        if final:
+            self.chat_history.delete(start, end)
+        self.chat_history.insert(end, text, tag)
+        if final:
+            self.chat_history.mark_unset(start, end)
         self.chat_history.see(tk.END)
         self.chat_history.config(state='disabled')
 
@@ -117,6 +144,9 @@ class DashboardView(tk.Frame):
         """Wipes the chat history window"""
         self.chat_history.config(state='normal') # Enable editing
         self.chat_history.delete('1.0', tk.END)  # Delete everything
+        for mark in self.chat_history.mark_names():
+            if mark.startswith("stream_"):
+                self.chat_history.mark_unset(mark)
         self.chat_history.config(state='disabled') # Disable editing
 
     def set_action_status(self, text):
@@ -147,20 +177,84 @@ class AdminView(DashboardView):
         self.tree.column("user", width=100)
         self.tree.column("book", width=150)
         self.tree.column("action", width=100)
-        
-        self.tree.pack(fill="both", expand=True, padx=10, pady=10)
-        
-        # Refresh Button
+
+        # Refresh Button (packed first so it stays visible under the table)
         tk.Button(tab_logs, text="REFRESH LOGS", command=controller.request_logs, 
-                  bg="#8E44AD", fg="white").pack(pady=10)
+                  bg="#8E44AD", fg="white").pack(side="bottom", pady=10)
+
+        # Older pages are fetched when the scrollbar nears the bottom (newer ones near the top,
+        # once the table has dropped them): at most LOG_VIEW_MAX rows are kept
+        self.scrollbar = ttk.Scrollbar(tab_logs, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self.on_log_scroll)
+        self.scrollbar.pack(side="right", fill="y", pady=10)
+        self.tree.pack(fill="both", expand=True, padx=(10, 0), pady=10)
 
-    def update_logs(self, log_data):
-        # Clear existing
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        # Add new
+        self.more_logs = False      # Server has rows older than the bottom row
+        self.newer_logs = False     # Rows newer than the top row were dropped (or not loaded yet)
+        self.loading = False
+
+    def update_logs(self, log_data, more=False):
+        """First page (or a refresh): replaces the table"""
+        self.tree.delete(*self.tree.get_children())
+        self.newer_logs = False
+        self.append_older_logs(log_data, more)
+
+    def append_older_logs(self, log_data, more):
+        for log in log_data:
+            self._insert_log(log, tk.END)
+        self.more_logs = more
+        self.loading = False
+        self._trim(from_top=True)
+
+    def prepend_newer_logs(self, log_data, more):
+        """Page just newer than the top row (newest first)"""
+        for log in reversed(log_data):
+            self._insert_log(log, 0)
+        self.newer_logs = more
+        self.loading = False
+        self._trim(from_top=False)
+
+    def add_new_logs(self, log_data):
+        """Rows pushed by the server as they happen (oldest first): newest ends up on top"""
+        if self.newer_logs:
+            return  # Scrolled far back: they are fetched when the top is reached again
         for log in log_data:
-            self.tree.insert("", tk.END, values=(log['timestamp'], log['name'], log['title'], log['action']))
+            self._insert_log(log, 0)
+        self._trim(from_top=False)
+
+    def on_log_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self.loading:
+            return
+        rows = self.tree.get_children()
+        if float(last) > 0.9 and self.more_logs and rows:
+            self.loading = True
+            self.controller.request_older_logs(self._cursor(rows[-1]))
+        elif float(first) < 0.1 and self.newer_logs and rows:
+            self.loading = True
+            self.controller.request_newer_logs(self._cursor(rows[0]))
+
+    def _trim(self, from_top):
+        """Drops rows beyond LOG_VIEW_MAX from the end furthest from where the admin is reading"""
+        rows = self.tree.get_children()
+        extra = len(rows) - config.LOG_VIEW_MAX
+        if extra <= 0:
+            return
+        if from_top:
+            self.tree.delete(*rows[:extra])
+            self.newer_logs = True
+        else:
+            self.tree.delete(*rows[-extra:])
+            self.more_logs = True
+
+    def _cursor(self, iid):
+        """[timestamp, id] of a row in the table"""
+        return [self.tree.item(iid, "values")[0], int(iid)]
+
+    def _insert_log(self, log, index):
+        iid = str(log['id'])
+        if not self.tree.exists(iid):  # A pushed row can also be in the first page
+            self.tree.insert("", index, iid=iid, values=(log['timestamp'], log['name'], log['title'], log['action']))
 
 class ScanPopup(tk.Toplevel):
     def __init__(self, parent, action_type, on_cancel, controller): # <--- Added controller
@@ -0,0 +1,105 @@
+import queue
+import threading
+import time
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.metrics import metrics
+from common.logger import get_logger
+
+log = get_logger("ai_jobs")
+
+metrics.describe("library_ai_queue_wait_seconds", "Time AI jobs wait for a free AI worker")
+metrics.describe("library_ai_exec_seconds", "Time an AI job runs (one upstream call, maybe shared)")
+metrics.describe("library_ai_jobs_total", "AI submissions by outcome (queued, coalesced, rejected)")
+metrics.describe("library_ai_jobs_finished_total", "AI jobs run by a worker, by result (ok, failed)")
+
+class AIExecutor:
+    """
+    Fixed pool of threads for slow AI calls.
+    Jobs with the same key that are already queued or running are merged:
+    the upstream call happens once and every caller gets the result
+    (and any progress reported while it runs).
+    """
+    def __init__(self, workers=2, queue_size=20):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.in_flight = {}  # key -> list of callbacks waiting for that job
+        self.listeners = {}  # key -> list of on_progress callbacks for that job
+        self.lock = threading.Lock()
+
+        for i in range(workers):
+            threading.Thread(target=self._worker_loop, name=f"ai-{i}", daemon=True).start()
+
+    def submit(self, key, func, callback, on_progress=None, fallback=None):
+        """
+        Runs func() in the pool and calls callback(result) when done.
+        If func() raises, every caller gets fallback() instead (so nobody waits forever).
+        on_progress(*args) receives whatever the job passes to progress(key, ...).
+        Returns False if the queue is full (caller should answer with a fallback).
+        """
+        with self.lock:
+            if key in self.in_flight:
+                self.in_flight[key].append(callback)
+                if on_progress:
+                    self.listeners[key].append(on_progress)
+                metrics.inc("library_ai_jobs_total", outcome="coalesced")
+                return True
+            try:
+                self.jobs.put_nowait((key, func, fallback, time.monotonic()))
+            except queue.Full:
+                metrics.inc("library_ai_jobs_total", outcome="rejected")
+                return False
+            self.in_flight[key] = [callback]
+            self.listeners[key] = [on_progress] if on_progress else []
+            metrics.inc("library_ai_jobs_total", outcome="queued")
+            return True
+
+    def progress(self, key, *args):
+        """Called by a running job: passes args to every caller merged into it"""
+        with self.lock:
+            listeners = list(self.listeners.get(key, ()))
+        for listener in listeners:
+            try:
+                listener(*args)
+            except Exception:
+                log.exception("AI PROGRESS ERROR")
+
+    def queue_depth(self):
+        return self.jobs.qsize()
+
+    def _worker_loop(self):
+        while True:
+            key, func, fallback, queued_at = self.jobs.get()
+            started = time.monotonic()
+            try:
+                result = func()
+                ok = True
+            except Exception:
+                log.exception("AI JOB ERROR")
+                ok = False
+            finished = time.monotonic()
+
+            with self.lock:
+                callbacks = self.in_flight.pop(key, [])
+                self.listeners.pop(key, None)
+            metrics.inc("library_ai_jobs_finished_total", result="ok" if ok else "failed")
+            metrics.observe("library_ai_queue_wait_seconds", started - queued_at)
+            metrics.observe("library_ai_exec_seconds", finished - started)
+
+            log.debug("AI JOB: wait %.0fms, exec %.0fms, %d caller(s)",
+                      (started - queued_at) * 1000, (finished - started) * 1000, len(callbacks))
+
+            if not ok:
+                try:
+                    result = fallback() if fallback else None
+                except Exception:
+                    log.exception("AI FALLBACK ERROR")
+                    result = None
+                if result is None:
+                    continue
+            for callback in callbacks:
+                try:
+                    callback(result)
+                except Exception:
+                    log.exception("AI CALLBACK ERROR")
@@ -1,36 +1,95 @@
 import json
-import requests
+import threading
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common import config
+from common.gemini_client import GeminiClient, GeminiError
+from common.logger import get_logger
+from rec_cache import RecommendationCache
+from catalog import CatalogSnapshot
+
+log = get_logger("ai")
+
+def normalize_prompt(text):
+    """Lowercase + collapse whitespace so trivially different prompts match"""
+    return " ".join((text or "").lower().split())
+
+def _id_line(line):
+    """Book ID from a streamed line ('' for blank lines and ``` fences)"""
+    line = line.strip()
+    if line.startswith("```"):
+        return ""
+    return line.strip('"`*')
+
+def _clean_reason(text):
+    """Streamed reason without markdown fence lines, stray fences or surrounding whitespace"""
+    lines = [line for line in text.split("\n") if not line.strip().startswith("```")]
+    return "\n".join(lines).replace("```", "").strip()
+
+def _shown_reason(text):
+    """
+    The part of a reason still being streamed that can be shown: ``` fence lines are
+    dropped as whole lines, and a last line that may still turn into one is held back.
+    Only ever grows as text grows, so callers can send just the new suffix.
+    """
+    *lines, last = text.split("\n")
+    kept = [line for line in lines if not line.strip().startswith("```")]
+    tail = last.lstrip()
+    if tail and not tail.startswith("```") and not "```".startswith(tail):
+        kept.append(last)
+    return "\n".join(kept).lstrip()
 
 class LibraryAI:
-    def __init__(self, db_conn):
-        self.db = db_conn
-        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={config.GEMINI_KEY}"
+    def __init__(self, db):
+        self.db = db  # ConnectionManager
+        self.client = GeminiClient()
+        self.catalog = CatalogSnapshot(db)
+        self.cache = RecommendationCache(config.AI_CACHE_SIZE, config.AI_CACHE_TTL)
+        self.cache_version = None  # Catalog version the cached answers were built from
+        self.cache_lock = threading.Lock()
+        if not config.GEMINI_KEY:
+            log.warning("GEMINI_API_KEY is not set: recommendations will use the local fallback")
 
-    def get_dynamic_catalog(self):
-        """Fetches real books from SQLite to give context to the AI"""
+    def get_catalog_version(self):
+        """
+        Bumped by triggers whenever a book is added, edited or deleted.
+        The in-memory value (kept current by the controller's refresh loop): no SQLite on the request path.
+        """
+        return self.catalog.version
+
+    def get_dynamic_catalog(self, user_text=None):
+        """
+        Real books (from the in-memory snapshot) to give context to the AI.
+        With user_text, only the best local matches are sent (keeps the prompt small).
+        """
         try:
-            rows = self.db.execute("SELECT book_id, title, description FROM books").fetchall()
-            catalog = [{"id": r["book_id"], "title": r["title"], "desc": r["description"]} for r in rows]
-            return json.dumps(catalog)
+            if user_text is None:
+                return self.catalog.to_json()
+            return self.catalog.to_json(self.catalog.shortlist(user_text, config.AI_SHORTLIST_SIZE))
         except Exception:
             return "[]"
 
+    def _cache_key(self, user_text):
+        # CACHE: same prompt + same catalog -> same answer
+        version = self.get_catalog_version()
+        with self.cache_lock:
+            if version != self.cache_version:
+                self.cache.clear()
+                self.cache_version = version
+        return (normalize_prompt(user_text), version)
+
     def get_recommendations(self, user_text):
-        # DEBUG: Check API Key Status
-        if not config.GEMINI_KEY:
-            print("DEBUG: API Key is MISSING or Empty!")
-        else:
-            print(f"DEBUG: API Key loaded (Length: {len(config.GEMINI_KEY)})")
+        cache_key = self._cache_key(user_text)
+        cached = self.cache.get(cache_key)
+        if cached:
+            return cached
 
-        print(f"Asking Gemini about: '{user_text}'...")
+        log.debug("Asking Gemini about: %r", user_text)
 
         try:
-            catalog_str = self.get_dynamic_catalog()
+            catalog_str = self.get_dynamic_catalog(user_text)
             
             payload = {
                 "contents": [{
@@ -51,31 +110,121 @@ class LibraryAI:
                 }]
             }
 
-            response = requests.post(self.api_url, json=payload, headers={'Content-Type': 'application/json'})
-            
-            if response.status_code != 200:
-                print(f"API ERROR {response.status_code}: {response.text}")
-                return self._get_fallback()
+            try:
+                data = self.client.generate(payload)
+            except GeminiError as e:
+                log.warning("API ERROR: %s", e)
+                return self.get_fallback(user_text)
 
             # Parse Response
-            raw = response.json()['candidates'][0]['content']['parts'][0]['text']
+            raw = data['candidates'][0]['content']['parts'][0]['text']
             clean = raw.replace("```json", "").replace("```", "").strip()
             result = json.loads(clean)
             
-            # Fetch from DB
-            book = self.db.execute("SELECT * FROM books WHERE book_id=?", (result['id'],)).fetchone()
+            # Look up in the catalog snapshot
+            book = self.catalog.get(result['id'])
             if book:
-                return [{
-                    "id": book["book_id"],
+                recs = [{
+                    "id": book["id"],
                     "title": book["title"],
-                    "desc": book["description"],
+                    "desc": book["desc"],
                     "reason": result["reason"]
                 }]
-            return self._get_fallback()
+                self.cache.put(cache_key, recs)
+                return recs
+            return self.get_fallback(user_text)
 
-        except Exception as e:
-            print(f"CRITICAL EXCEPTION: {e}")
-            return self._get_fallback()
+        except Exception:
+            log.exception("Recommendation failed")
+            return self.get_fallback(user_text)
         
-    def _get_fallback(self):
+    def stream_recommendations(self, user_text, on_chunk):
+        """
+        Like get_recommendations, but the answer is streamed: Gemini writes the
+        book ID on the first line, then the reason. on_chunk(book, reason_so_far)
+        is called as the reason grows, so the terminal can show it word by word.
+        Cached answers and fallbacks come back without any chunks.
+        """
+        cache_key = self._cache_key(user_text)
+        cached = self.cache.get(cache_key)
+        if cached:
+            return cached
+
+        log.debug("Streaming from Gemini: %r", user_text)
+        payload = {
+            "contents": [{
+                "parts": [{
+                    "text": f"""
+                    You are a Library System.
+                    REAL CATALOG: {self.get_dynamic_catalog(user_text)}
+                    USER INPUT: "{user_text}"
+
+                    TASK:
+                    1. Pick the ONE best book ID from the catalog.
+                    2. Write a reason (max 10 words).
+
+                    FORMAT (plain text, no JSON, no markdown):
+                    Line 1: the book ID only
+                    Line 2: the reason
+                    """
+                }]
+            }]
+        }
+
+        head, reason, book, shown_len = "", "", None, 0
+        try:
+            for text in self.client.stream_generate(payload):
+                if book is None:
+                    # 1. Buffer until the ID line is complete (blank lines and ``` fences before it are skipped)
+                    head += text
+                    while book is None and "\n" in head:
+                        line, head = head.split("\n", 1)
+                        if not _id_line(line):
+                            continue
+                        book = self.catalog.get(_id_line(line))
+                        if book is None:
+                            log.warning("Gemini picked an unknown book: %r", line)
+                            return self.get_fallback(user_text)
+                    if book is None:
+                        continue
+                    text, head = head, ""
+                # 2. Forward the reason as it grows (append-only: fences never change what was sent)
+                reason += text
+                shown = _shown_reason(reason)
+                if len(shown) > shown_len:
+                    shown_len = len(shown)
+                    on_chunk(book, shown)
+        except GeminiError as e:
+            log.warning("API ERROR: %s", e)
+            if book is None or not _clean_reason(reason):
+                return self.get_fallback(user_text)
+            # Cut off mid-reason: keep the book, don't cache the partial answer
+            return [{"id": book["id"], "title": book["title"], "desc": book["desc"], "reason": _clean_reason(reason)}]
+        except Exception:
+            log.exception("Recommendation failed")
+            return self.get_fallback(user_text)
+
+        if book is None:
+            # The answer ended without a newline after the ID: an ID with no reason
+            book = self.catalog.get(_id_line(head))
+            if book is None:
+                return self.get_fallback(user_text)
+        recs = [{
+            "id": book["id"],
+            "title": book["title"],
+            "desc": book["desc"],
+            "reason": _clean_reason(reason) or "Picked from the catalog for you."
+        }]
+        self.cache.put(cache_key, recs)
+        return recs
+
+    def get_fallback(self, user_text=None):
+        """Best local (BM25) match when Gemini can't answer"""
+        try:
+            ids = self.catalog.search(user_text, 1) if user_text else []
+            if ids:
+                book = self.catalog.get(ids[0])
+                return [{"id": book["id"], "title": book["title"], "desc": book["desc"], "reason": "Best local match (AI offline)."}]
+        except Exception:
+            log.exception("FALLBACK ERROR")
         return [{"title": "System Offline", "desc": "Check API Key", "reason": "AI unavailable."}]
\ No newline at end of file
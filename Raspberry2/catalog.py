@@ -0,0 +1,145 @@
+import json
+import threading
+from itertools import islice
+from search_index import BM25Index
+from common.logger import get_logger
+
+log = get_logger("catalog")
+
+BOOK_QUERY = "SELECT book_id, title, author, genre, description FROM books"
+
+class CatalogSnapshot:
+    """
+    In-memory copy of the books table with a version number.
+    refresh() applies only the rows listed in catalog_changes since the last
+    version, and each book's JSON is encoded once and reused across requests.
+    """
+    def __init__(self, db):
+        self.db = db  # ConnectionManager
+        self.lock = threading.Lock()
+        # Held from applying a change until every listener has seen it, so listeners
+        # get changes one at a time, in version order (re-entrant: refresh may reload)
+        self.notify_lock = threading.RLock()
+        self.version = 0
+        self.books = {}    # book_id -> {"id", "title", "author", "genre", "desc"}
+        self.encoded = {}  # book_id -> JSON fragment sent to the AI
+        self._json = None  # Whole catalog as JSON (built lazily, once per version)
+        self.index = BM25Index()  # Title/author/genre/description search
+        self.listeners = []  # Called with changed book ids (None = full reload) and the new version
+        self.reload()
+
+    def reload(self):
+        """Full rebuild (startup, or after a bulk import)"""
+        with self.notify_lock:
+            with self.lock:
+                # Read the version first: a change that lands in between is simply re-applied later
+                conn = self.db.reader()
+                version = self._current_version(conn)
+                rows = conn.execute(BOOK_QUERY).fetchall()
+                self.books.clear()
+                self.encoded.clear()
+                self.index.clear()
+                for row in rows:
+                    self._put(row)
+                self.version = version
+                self._json = None
+            self._notify(None, version)
+
+    def refresh(self):
+        """Applies pending catalog_changes. Returns the current version."""
+        with self.notify_lock:
+            return self._refresh()
+
+    def _refresh(self):
+        with self.lock:
+            conn = self.db.reader()
+            changes = conn.execute(
+                "SELECT seq, book_id, op FROM catalog_changes WHERE seq > ? ORDER BY seq",
+                (self.version,)
+            ).fetchall()
+            if not changes:
+                return self.version
+            reload_needed = any(c["op"] == "reload" for c in changes)
+            changed = {c["book_id"] for c in changes}
+            if not reload_needed:
+                # Re-read each touched book once; missing rows were deleted
+                for book_id in changed:
+                    row = conn.execute(f"{BOOK_QUERY} WHERE book_id=?", (book_id,)).fetchone()
+                    if row:
+                        self._put(row)
+                    else:
+                        self.books.pop(book_id, None)
+                        self.encoded.pop(book_id, None)
+                        self.index.remove(book_id)
+                self.version = changes[-1]["seq"]
+                self._json = None
+                version = self.version
+
+        if reload_needed:
+            self.reload()
+            return self.version
+        self._notify(changed, version)
+        return version
+
+    def add_listener(self, func):
+        """
+        func(book_ids, version) runs after every change, in version order;
+        book_ids is None after a full reload
+        """
+        self.listeners.append(func)
+
+    def to_json(self, book_ids=None):
+        """JSON list for the AI prompt: the whole catalog, or just the given books"""
+        with self.lock:
+            if book_ids is not None:
+                return "[" + ", ".join(self.encoded[b] for b in book_ids if b in self.encoded) + "]"
+            if self._json is None:
+                self._json = "[" + ", ".join(self.encoded.values()) + "]"
+            return self._json
+
+    def get(self, book_id):
+        return self.books.get(book_id)
+
+    def export(self, book_ids=None):
+        """(version, [book dicts]) read together, for terminals' local caches"""
+        with self.lock:
+            if book_ids is None:
+                return self.version, list(self.books.values())
+            return self.version, [self.books[b] for b in book_ids if b in self.books]
+
+    def search(self, text, k=10):
+        """Book ids that best match the text (BM25), best first"""
+        with self.lock:
+            return [book_id for book_id, _ in self.index.search(text, k)]
+
+    def shortlist(self, text, k=10):
+        """Candidates for the AI prompt. With no keyword match, any k books will do."""
+        ids = self.search(text, k)
+        if not ids:
+            with self.lock:
+                ids = list(islice(self.books, k))
+        return ids
+
+    def _notify(self, book_ids, version):
+        for func in self.listeners:
+            try:
+                func(book_ids, version)
+            except Exception:
+                log.exception("CATALOG LISTENER ERROR")
+
+    def _current_version(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM catalog_changes").fetchone()[0]
+
+    def _put(self, row):
+        book = {
+            "id": row["book_id"],
+            "title": row["title"],
+            "author": row["author"],
+            "genre": row["genre"],
+            "desc": row["description"]
+        }
+        self.books[book["id"]] = book
+        self.encoded[book["id"]] = json.dumps({"id": book["id"], "title": book["title"], "desc": book["desc"]})
+        # Title and genre count double
+        fields = (book["title"], book["title"], book["author"], book["genre"], book["genre"], book["desc"])
+        self.index.add(book["id"], " ".join(f or "" for f in fields))
@@ -0,0 +1,75 @@
+import threading
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import config
+from common.logger import get_logger
+
+log = get_logger("catalog_feed")
+
+class CatalogFeed:
+    """
+    Keeps terminals' local catalog caches current over MQTT.
+    A full snapshot is retained on TOPIC_CATALOG (new terminals get it on
+    subscribe), and every change goes out as a retained delta on
+    TOPIC_CATALOG_DELTA carrying the version it applies to ("from").
+    A terminal whose version doesn't match asks for catalog_sync.
+    """
+    def __init__(self, catalog):
+        self.catalog = catalog  # CatalogSnapshot
+        self.publish = None     # publish(topic, data) -> retained MQTT message
+        self.lock = threading.Lock()  # Deltas go out in version order
+        self.version = None     # Last version terminals were told about
+        self.deltas_since_snapshot = 0
+
+    def start(self, publish):
+        self.publish = publish
+        self.catalog.add_listener(self.on_change)
+        with self.lock:
+            self._publish_snapshot()
+
+    def snapshot(self):
+        version, books = self.catalog.export()
+        return {"type": "catalog_snapshot", "version": version, "books": [_display(b) for b in books]}
+
+    def on_change(self, book_ids, version):
+        """
+        CatalogSnapshot listener (book_ids is None after a full reload).
+        Called in version order while the catalog holds no newer change,
+        so the books read here are exactly those of `version`.
+        """
+        if self.publish is None:
+            return
+        with self.lock:
+            if book_ids is None:
+                self._publish_snapshot()
+                return
+            if self.version is not None and version <= self.version:
+                return  # Already in the snapshot published at start()
+            _, books = self.catalog.export(book_ids)
+            found = {b["id"] for b in books}
+            delta = {
+                "type": "catalog_delta",
+                "from": self.version,
+                "version": version,
+                "upsert": [_display(b) for b in books],
+                "delete": [b for b in book_ids if b not in found]
+            }
+            self.publish(config.TOPIC_CATALOG_DELTA, delta)
+            self.version = version
+            self.deltas_since_snapshot += 1
+            # Keep the retained snapshot close, so new terminals rarely need a sync
+            if self.deltas_since_snapshot >= config.CATALOG_SNAPSHOT_EVERY:
+                self._publish_snapshot()
+
+    def _publish_snapshot(self):
+        data = self.snapshot()
+        self.publish(config.TOPIC_CATALOG, data)
+        self.version = data["version"]
+        self.deltas_since_snapshot = 0
+        log.info("CATALOG SNAPSHOT: version %s, %d books", data["version"], len(data["books"]))
+
+def _display(book):
+    """What a terminal shows for a book scan"""
+    return {"id": book["id"], "title": book["title"], "author": book["author"], "desc": book["desc"]}
@@ -1,13 +1,59 @@
 import json
 import threading
+import time
+import sys
+import os
 import database
-from ai_service import LibraryAI
+from db_pool import ConnectionManager
+from ai_service import LibraryAI, normalize_prompt
+from ai_executor import AIExecutor
+from log_writer import LogWriter
+from directory import CardDirectory
+from sessions import SessionStore
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import config
+from common.logger import get_logger
+
+log = get_logger("controller")
+
+# Shown when the AI queue is full
+AI_BUSY_BOOK = {"title": "AI Busy", "desc": "Too many requests right now.", "reason": "Try again in a moment."}
+
+def _log_cursor(value):
+    """[timestamp, id] from a terminal (None if absent); ValueError if malformed"""
+    if not value:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError("cursor must be [timestamp, id]")
+    return [str(value[0]), int(value[1])]
 
 class LibraryController:
     def __init__(self):
-        self.db = database.db_connect()
+        # Per-thread read connections + one serialized writer
+        self.db = ConnectionManager()
         self.ai = LibraryAI(self.db)
-        self.active_sessions = {}
+        self.ai_jobs = AIExecutor(config.AI_WORKERS, config.AI_QUEUE_SIZE)
+        # Logins and book views are buffered and written in batches
+        self.log_writer = LogWriter(self.db, config.LOG_BATCH_SIZE, config.LOG_FLUSH_INTERVAL)
+        # Card ID -> user/book in memory, so scans don't hit SQLite
+        self.directory = CardDirectory(self.db, config.UNKNOWN_CARD_TTL)
+        self.ai.catalog.add_listener(self.directory.on_catalog_change)
+        # Token -> session; restored from the last snapshot so a restart keeps terminals logged in
+        # Ended ones are kept as long as msg_ids, for borrow/return requests queued before they ended
+        self.sessions = SessionStore(config.SESSION_TTL, config.SESSION_FILE, config.SESSION_SWEEP_INTERVAL,
+                                     config.DEDUP_TTL)
+        self.sessions.restore()
+        self.sessions.start()
+        # Admin token -> callback: new log rows are pushed to their terminal
+        self.log_watchers = {}
+        self.log_watch_lock = threading.Lock()
+        self.last_log_id = self.db.read(database.last_log_id)
+
+        # Pick up catalog and user edits made outside the server (imports, admin tools)
+        threading.Thread(target=self._catalog_loop, name="catalog-refresh", daemon=True).start()
+        threading.Thread(target=self._log_feed_loop, name="log-feed", daemon=True).start()
+        threading.Thread(target=self._dedup_prune_loop, name="dedup-prune", daemon=True).start()
 
     def handle_scan(self, payload, publish_callback):
         """
@@ -15,7 +61,7 @@ class LibraryController:
         publish_callback: A function to send data back to MQTT (used for AI threading)
         """
         scanned_id = payload.get("id")
-        result = database.scan_id(self.db, scanned_id)
+        result = self.directory.resolve(scanned_id)
         
         if result.get("status") == "error":
             return {"status": "error", "message": result.get("message")}
@@ -23,34 +69,43 @@ class LibraryController:
         # 1. LOGIN LOGIC
         if result["type"] == "login":
             user_name = result["user"]
-            self.active_sessions[user_name] = result["user_id"]
-            database.log_action(self.db, result["user_id"], "login")
+            token = self.sessions.create(result["user_id"], user_name, result["role"], payload.get("terminal"))
+            self.log_writer.log(result["user_id"], "login")
             
-            # Start AI Recommendation in Background Thread (Don't block login!)
-            def bg_recommend():
-                rec = self.ai.get_recommendations(f"Recommend a book about {result['interest']}")[0]
-                # Send a second update with the book
-                publish_callback({
-                    "type": "chat_response", # Or a specific 'rec_update' type
-                    "user": user_name,
-                    "book": rec
-                })
-            threading.Thread(target=bg_recommend).start()
+            # Nightly pick for this interest (precompute.py): shown immediately
+            picks = self.db.read(database.get_recommendations, normalize_prompt(result["interest"]))
+            book = picks[0] if picks else {"title": "Loading...", "desc": "AI is thinking...", "reason": "..."}
+
+            # Queue AI Recommendation in the AI pool (Don't block login!)
+            # Users with the same interest logging in together share one Gemini call
+            if not picks or config.AI_REFINE_ON_LOGIN:
+                prompt = f"Recommend a book about {result['interest']}"
+                def send_rec(recs):
+                    # Send a second update with the book
+                    publish_callback({
+                        "type": "chat_response", # Or a specific 'rec_update' type
+                        "user": user_name,
+                        "book": recs[0]
+                    })
+                if not self._submit_ai(prompt, send_rec, self._chunk_sender(publish_callback, user_name)) and not picks:
+                    send_rec([AI_BUSY_BOOK])
 
             return {
                 "type": "login",
                 "user": user_name,
                 "role": result["role"],
-                "book": {"title": "Loading...", "desc": "AI is thinking...", "reason": "..."} 
+                "token": token,
+                "catalog_version": self.ai.catalog.version,  # Lets the terminal check its local copy
+                "book": book
             }
 
         # 2. BOOK LOGIC
         elif result["type"] == "book_scan":
             # Log view if someone is logged in
             user = payload.get("user")
-            user_id = self.active_sessions.get(user)
-            if user_id:
-                database.log_action(self.db, user_id, "viewed_book", result["id"])
+            session = self.sessions.get(payload.get("token"))
+            if session:
+                self.log_writer.log(session["user_id"], "viewed_book", result["id"])
 
             return {
                 "type": "chat_response",
@@ -58,31 +113,176 @@ class LibraryController:
                 "book": {"id": result["id"], "title": result["title"], "desc": result["desc"], "reason": "Scanned Book"}
             }
 
+    def _replayed(self, payload):
+        """Stored reply if this msg_id was already handled (checked before the session, which may have expired since)"""
+        msg_id = payload.get("msg_id")
+        previous = self.db.read(database.processed_reply, msg_id) if msg_id else None
+        return {**previous, "duplicate": True} if previous else None
+
+    def _queued_session(self, payload):
+        """
+        Session for a borrow/return: the live one, or (for a request replayed from a
+        terminal's outbox) the one that was live when the terminal queued it
+        """
+        session = self.sessions.get(payload.get("token"))
+        if session is None and payload.get("msg_id"):
+            session = self.sessions.ended(payload.get("token"), payload.get("queued"))
+        return session
+
     def handle_borrow(self, payload):
-        user = payload.get("user")
-        user_id = self.active_sessions.get(user)
-        if not user_id: return {"status": "error", "message": "Session Expired"}
-        return database.borrow_book(self.db, user_id, payload.get("book_id"))
+        previous = self._replayed(payload)
+        if previous: return previous
+        session = self._queued_session(payload)
+        if not session: return database.action_error("SESSION_EXPIRED", "Session Expired")
+        user_id = session["user_id"]
+        result = self.db.write(database.borrow_book, user_id, payload.get("book_id"), payload.get("msg_id"))
+        if result.get("status") == "success":
+            self.directory.set_borrowed(user_id, payload.get("book_id"))
+        return result
 
     def handle_return(self, payload):
-        user = payload.get("user")
-        user_id = self.active_sessions.get(user)
-        if not user_id: return {"status": "error", "message": "Session Expired"}
-        return database.return_book(self.db, user_id, payload.get("book_id"))
+        previous = self._replayed(payload)
+        if previous: return previous
+        session = self._queued_session(payload)
+        if not session: return database.action_error("SESSION_EXPIRED", "Session Expired")
+        user_id = session["user_id"]
+        result = self.db.write(database.return_book, user_id, payload.get("book_id"), payload.get("msg_id"))
+        if result.get("status") == "success":
+            self.directory.set_returned(user_id, payload.get("book_id"))
+        return result
+
+    def handle_view(self, payload):
+        """A terminal showed a book from its local catalog: only the log needs to know"""
+        session = self.sessions.get(payload.get("token"))
+        if session:
+            self.log_writer.log(session["user_id"], "viewed_book", payload.get("book_id"))
 
-    def handle_logs(self):
-        return {"type": "log_data", "logs": database.get_logs(self.db)}
+    def handle_logout(self, payload):
+        with self.log_watch_lock:
+            self.log_watchers.pop(payload.get("token"), None)
+        self.sessions.remove(payload.get("token"))
+
+    def handle_logs(self, payload, publish_callback):
+        """
+        One page of the log (newest first, or older/newer than a cursor).
+        Admins asking for the first page are also sent every new row from then on.
+        """
+        try:
+            before, after = _log_cursor(payload.get("before")), _log_cursor(payload.get("after"))
+            limit = max(1, min(int(payload.get("limit") or config.LOG_PAGE_SIZE), config.LOG_PAGE_MAX))
+        except (TypeError, ValueError):
+            return database.action_error("BAD_REQUEST", "Invalid log page request")
+        if not before:
+            self.log_writer.flush()  # Include buffered rows
+        logs = self.db.read(database.get_logs, before, after, limit)
+
+        session = self.sessions.get(payload.get("token"))
+        if session and session["role"] == "admin" and not before and not after:
+            with self.log_watch_lock:
+                self.log_watchers[payload["token"]] = publish_callback
+        return {"type": "log_data", "logs": logs, "before": before, "after": after, "more": len(logs) == limit}
+
+    def handle_stats(self):
+        self.log_writer.flush()  # Buffered views/logins count too
+        return {"type": "stats_data", "stats": self.db.read(database.get_stats)}
 
     def handle_chat(self, payload, publish_callback):
-        """Runs AI Chat in a background thread"""
-        def task():
-            recs = self.ai.get_recommendations(payload.get("text"))
+        """Runs AI Chat in the AI pool"""
+        def send_reply(recs):
             response = {
                 "type": "chat_response",
                 "user": payload.get("user"),
                 "book": recs[0]
             }
             publish_callback(response)
-        
-        threading.Thread(target=task).start()
-        return None # No immediate response, it comes later via callback
\ No newline at end of file
+
+        on_chunk = self._chunk_sender(publish_callback, payload.get("user"))
+        if not self._submit_ai(payload.get("text", ""), send_reply, on_chunk):
+            return {"status": "error", "user": payload.get("user"), "message": "AI is busy, please try again"}
+        return None # No immediate response, it comes later via callback
+
+    def _submit_ai(self, prompt, callback, on_chunk=None):
+        # Identical prompts (ignoring case/spacing) are merged into one upstream call
+        key = normalize_prompt(prompt)
+        # If the job itself crashes, every waiting caller still gets an answer
+        fallback = lambda: self.ai.get_fallback(prompt)
+        if not config.AI_STREAM:
+            return self.ai_jobs.submit(key, lambda: self.ai.get_recommendations(prompt), callback, fallback=fallback)
+        def job():
+            return self.ai.stream_recommendations(prompt, lambda book, reason: self.ai_jobs.progress(key, book, reason))
+        return self.ai_jobs.submit(key, job, callback, on_chunk, fallback)
+
+    def _chunk_sender(self, publish_callback, user):
+        """
+        Streams one caller's reply as chat_chunk messages (seq 0, 1, ...).
+        Each sends only the reason text this caller hasn't had yet, so a caller
+        merged into a job that was already streaming still gets the start.
+        """
+        state = {"seq": 0, "sent": 0}
+        def send_chunk(book, reason):
+            text = reason[state["sent"]:]
+            if not text:
+                return
+            chunk = {"type": "chat_chunk", "user": user, "seq": state["seq"], "text": text}
+            if state["seq"] == 0:
+                chunk["book"] = {"id": book["id"], "title": book["title"], "desc": book["desc"]}
+            state["seq"] += 1
+            state["sent"] = len(reason)
+            publish_callback(chunk)
+        return send_chunk
+
+    def _catalog_loop(self):
+        while True:
+            time.sleep(config.CATALOG_REFRESH_INTERVAL)
+            try:
+                self.ai.catalog.refresh()
+            except Exception:
+                log.exception("CATALOG REFRESH ERROR")
+            try:
+                self.directory.refresh()
+            except Exception:
+                log.exception("DIRECTORY REFRESH ERROR")
+
+    def _dedup_prune_loop(self):
+        while True:
+            try:
+                self.db.write(database.prune_processed, config.DEDUP_TTL)
+            except Exception:
+                log.exception("DEDUP PRUNE ERROR")
+            time.sleep(3600)
+
+    def _log_feed_loop(self):
+        while True:
+            time.sleep(config.LOG_PUSH_INTERVAL)
+            try:
+                self._push_new_logs()
+            except Exception:
+                log.exception("LOG FEED ERROR")
+
+    def _push_new_logs(self):
+        """Sends rows added since the last pass to every watching admin"""
+        with self.log_watch_lock:
+            for token in [t for t in self.log_watchers if not self.sessions.peek(t)]:
+                del self.log_watchers[token]  # Logged out or expired
+            watchers = list(self.log_watchers.values())
+        if not watchers:
+            # Nobody to tell: just move the mark so the next admin doesn't get a backlog
+            self.last_log_id = self.db.read(database.last_log_id)
+            return
+        rows = self.db.read(database.get_logs_since, self.last_log_id)
+        if not rows:
+            return
+        self.last_log_id = rows[-1]["id"]
+        for publish in watchers:
+            publish({"type": "log_delta", "logs": rows})
+
+    def close(self):
+        """Called on shutdown: write out buffered log rows, save sessions, close connections"""
+        # Each step runs even if an earlier one fails (e.g. the session snapshot can't be written)
+        try:
+            self.log_writer.close()
+        finally:
+            try:
+                self.sessions.close()
+            finally:
+                self.db.close()
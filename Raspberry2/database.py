@@ -1,16 +1,31 @@
+import json
 import sqlite3
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common import config
+from common.metrics import metrics
+from common.logger import get_logger
 
-def db_connect():
+log = get_logger("db")
+
+metrics.describe("library_db_seconds", "Time spent in each database function")
+
+def db_connect(path=None, read_only=False):
     # Use the shared config path
-    conn = sqlite3.connect(config.DB_PATH, check_same_thread=False)
+    # Statements are prepared once per connection and reused from its cache
+    conn = sqlite3.connect(path or config.DB_PATH, check_same_thread=False,
+                           cached_statements=config.DB_STATEMENT_CACHE)
     conn.row_factory = sqlite3.Row
+    # WAL: readers and the log writer no longer block borrow/return commits
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if read_only:
+        conn.execute("PRAGMA query_only=ON")
     return conn
 
+@metrics.timed("library_db_seconds")
 def scan_id(conn, scanned_id):
     # 1. Try to find a USER
     user = conn.execute(
@@ -48,42 +63,107 @@ def scan_id(conn, scanned_id):
 
     return {"status": "error", "message": "Unknown ID"}
 
-def borrow_book(conn, user_id, book_id):
-    # Logic: Check if user exists, check if book is available
+def action_error(code, message):
+    """Structured error result: 'code' is for programs, 'message' is for the screen"""
+    return {"status": "error", "code": code, "message": message}
+
+def _processed(conn, msg_id):
+    row = conn.execute("SELECT reply FROM processed_messages WHERE msg_id=?", (msg_id,)).fetchone()
+    return json.loads(row["reply"]) if row else None
+
+def _remember(conn, msg_id, reply):
+    """Records the reply inside the caller's transaction (no-op without a msg_id)"""
+    if msg_id:
+        conn.execute("INSERT OR IGNORE INTO processed_messages (msg_id, reply) VALUES (?, ?)",
+                     (msg_id, json.dumps(reply)))
+
+@metrics.timed("library_db_seconds")
+def processed_reply(conn, msg_id):
+    """The reply already sent for msg_id, or None if it was never handled"""
+    return _processed(conn, msg_id)
+
+@metrics.timed("library_db_seconds")
+def prune_processed(conn, max_age):
+    """Forgets msg_ids older than max_age seconds (no outbox holds them that long)"""
+    conn.execute("DELETE FROM processed_messages WHERE created < datetime('now', ?)", (f"-{int(max_age)} seconds",))
+    conn.commit()
+
+@metrics.timed("library_db_seconds")
+def borrow_book(conn, user_id, book_id, msg_id=None):
+    # Compare-and-set: the UPDATE only claims the book if it is still available
+    # and the user has no book, so two terminals can never borrow the same copy.
     try:
-        user = conn.execute("SELECT user_id, current_book_id FROM users WHERE user_id=?", (user_id,)).fetchone()
-        book = conn.execute("SELECT book_id, status FROM books WHERE book_id=?", (book_id,)).fetchone()
+        conn.execute("BEGIN IMMEDIATE")
+        previous = _processed(conn, msg_id) if msg_id else None
+        if previous:
+            conn.rollback()
+            return {**previous, "duplicate": True}
+        claimed = conn.execute("""
+            UPDATE books SET status='borrowed'
+            WHERE book_id=? AND status='available'
+              AND EXISTS (SELECT 1 FROM users WHERE user_id=? AND current_book_id IS NULL)
+        """, (book_id, user_id)).rowcount
 
-        if not user: return {"status": "error", "message": "User not found"}
-        if not book: return {"status": "error", "message": "Book not found"}
-        if user["current_book_id"]: return {"status": "error", "message": "You already have a book borrowed!"}
-        if book["status"] != "available": return {"status": "error", "message": "Book is already borrowed"}
+        if not claimed:
+            # Only now look at why (the happy path never SELECTs)
+            user = conn.execute("SELECT current_book_id FROM users WHERE user_id=?", (user_id,)).fetchone()
+            book = conn.execute("SELECT status FROM books WHERE book_id=?", (book_id,)).fetchone()
+            if not user: result = action_error("USER_NOT_FOUND", "User not found")
+            elif not book: result = action_error("BOOK_NOT_FOUND", "Book not found")
+            elif user["current_book_id"]: result = action_error("ALREADY_BORROWING", "You already have a book borrowed!")
+            else: result = action_error("BOOK_UNAVAILABLE", "Book is already borrowed")
+            # Nothing changed, but a replay must get this answer too (not borrow the book later)
+            _remember(conn, msg_id, result)
+            conn.commit()
+            return result
 
-        # Perform Transaction
         conn.execute("UPDATE users SET current_book_id=? WHERE user_id=?", (book_id, user_id))
-        conn.execute("UPDATE books SET status='borrowed' WHERE book_id=?", (book_id,))
         conn.execute("INSERT INTO log(user_id, book_id, action) VALUES (?, ?, 'borrowed')", (user_id, book_id))
+        result = {"status": "success", "type": "action_confirm", "message": f"Successfully borrowed book {book_id}"}
+        _remember(conn, msg_id, result)
         conn.commit()
-        return {"status": "success", "type": "action_confirm", "message": f"Successfully borrowed book {book_id}"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return result
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.rollback()
+        log.error("BORROW ERROR: %s", e)
+        return action_error("DB_ERROR", "Database busy, please try again")
 
-def return_book(conn, user_id, book_id):
+@metrics.timed("library_db_seconds")
+def return_book(conn, user_id, book_id, msg_id=None):
+    # Compare-and-set: only clears the loan if this user still holds this book
     try:
-        user = conn.execute("SELECT user_id, current_book_id FROM users WHERE user_id=?", (user_id,)).fetchone()
-        
-        if not user: return {"status": "error", "message": "User not found"}
-        if user["current_book_id"] != book_id: return {"status": "error", "message": "You don't have this book borrowed."}
+        conn.execute("BEGIN IMMEDIATE")
+        previous = _processed(conn, msg_id) if msg_id else None
+        if previous:
+            conn.rollback()
+            return {**previous, "duplicate": True}
+        released = conn.execute(
+            "UPDATE users SET current_book_id=NULL WHERE user_id=? AND current_book_id=?",
+            (user_id, book_id)
+        ).rowcount
+
+        if not released:
+            user = conn.execute("SELECT 1 FROM users WHERE user_id=?", (user_id,)).fetchone()
+            if not user: result = action_error("USER_NOT_FOUND", "User not found")
+            else: result = action_error("NOT_BORROWED", "You don't have this book borrowed.")
+            _remember(conn, msg_id, result)
+            conn.commit()
+            return result
 
-        # Perform Transaction
-        conn.execute("UPDATE users SET current_book_id=NULL WHERE user_id=?", (user_id,))
         conn.execute("UPDATE books SET status='available' WHERE book_id=?", (book_id,))
         conn.execute("INSERT INTO log(user_id, book_id, action) VALUES (?, ?, 'returned')", (user_id, book_id))
+        result = {"status": "success", "type": "action_confirm", "message": f"Successfully returned book {book_id}"}
+        _remember(conn, msg_id, result)
         conn.commit()
-        return {"status": "success", "type": "action_confirm", "message": f"Successfully returned book {book_id}"}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        return result
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.rollback()
+        log.error("RETURN ERROR: %s", e)
+        return action_error("DB_ERROR", "Database busy, please try again")
     
+@metrics.timed("library_db_seconds")
 def log_action(conn, user_id, action, book_id=None):
     try:
         conn.execute(
@@ -92,20 +172,122 @@ def log_action(conn, user_id, action, book_id=None):
         )
         conn.commit()
     except Exception as e:
-        print(f"LOG ERROR: {e}")
+        log.error("LOG ERROR: %s", e)
+
+@metrics.timed("library_db_seconds")
+def log_actions(conn, rows):
+    """Writes many (timestamp, user_id, book_id, action) rows in one transaction"""
+    try:
+        conn.executemany(
+            "INSERT INTO log (timestamp, user_id, book_id, action) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+LOG_COLUMNS = """
+    SELECT log.rowid AS id, log.timestamp, users.name, books.title, log.action
+    FROM log
+    LEFT JOIN users ON log.user_id = users.user_id
+    LEFT JOIN books ON log.book_id = books.book_id
+"""
 
-def get_logs(conn):
+@metrics.timed("library_db_seconds")
+def get_logs(conn, before=None, after=None, limit=50):
+    """
+    One page of the log, newest first.
+    before / after are [timestamp, id] cursors taken from a row already shown:
+    the page is the rows just older / just newer than it. (timestamp, rowid)
+    is the key of idx_log_timestamp, so every page is a short index range scan.
+    """
     try:
-        # Join tables to get readable names instead of just IDs
-        query = """
-            SELECT log.timestamp, users.name, books.title, log.action 
-            FROM log
-            LEFT JOIN users ON log.user_id = users.user_id
-            LEFT JOIN books ON log.book_id = books.book_id
-            ORDER BY log.timestamp DESC LIMIT 50
-        """
-        rows = conn.execute(query).fetchall()
+        if before:
+            rows = conn.execute(
+                LOG_COLUMNS + "WHERE (log.timestamp, log.rowid) < (?, ?) ORDER BY log.timestamp DESC, log.rowid DESC LIMIT ?",
+                (before[0], before[1], limit)
+            ).fetchall()
+        elif after:
+            rows = conn.execute(
+                LOG_COLUMNS + "WHERE (log.timestamp, log.rowid) > (?, ?) ORDER BY log.timestamp, log.rowid LIMIT ?",
+                (after[0], after[1], limit)
+            ).fetchall()[::-1]
+        else:
+            rows = conn.execute(
+                LOG_COLUMNS + "ORDER BY log.timestamp DESC, log.rowid DESC LIMIT ?", (limit,)
+            ).fetchall()
         # Convert to list of dicts for JSON serialization
         return [dict(row) for row in rows]
     except Exception as e:
-        return []
\ No newline at end of file
+        log.error("LOGS ERROR: %s", e)
+        return []
+
+@metrics.timed("library_db_seconds")
+def get_logs_since(conn, last_id, limit=500):
+    """Rows inserted after rowid last_id, in insert order (for pushing deltas)"""
+    rows = conn.execute(LOG_COLUMNS + "WHERE log.rowid > ? ORDER BY log.rowid LIMIT ?", (last_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+@metrics.timed("library_db_seconds")
+def last_log_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM log").fetchone()[0]
+
+@metrics.timed("library_db_seconds")
+def get_recommendations(conn, interest, limit=3):
+    """Precomputed picks for a (normalized) interest, best first; books since deleted are skipped"""
+    rows = conn.execute("""
+        SELECT books.book_id AS id, books.title, books.description AS "desc", recommendations.reason
+        FROM recommendations
+        JOIN books ON recommendations.book_id = books.book_id
+        WHERE recommendations.interest = ?
+        ORDER BY recommendations.rank LIMIT ?
+    """, (interest, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+@metrics.timed("library_db_seconds")
+def save_recommendations(conn, results, catalog_version):
+    """Replaces the picks for each interest in results ({interest: [(book_id, reason), ...]}) in one transaction"""
+    try:
+        for interest, picks in results.items():
+            conn.execute("DELETE FROM recommendations WHERE interest=?", (interest,))
+            conn.executemany(
+                "INSERT INTO recommendations (interest, rank, book_id, reason, catalog_version) VALUES (?, ?, ?, ?, ?)",
+                ((interest, rank, book_id, reason, catalog_version) for rank, (book_id, reason) in enumerate(picks, 1))
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+@metrics.timed("library_db_seconds")
+def get_stats(conn, top=10, days=14):
+    """Admin dashboard from the summary tables (kept up to date by a trigger on log)"""
+    try:
+        top_borrowed = conn.execute("""
+            SELECT stats_book.book_id, books.title, stats_book.borrows
+            FROM stats_book LEFT JOIN books ON stats_book.book_id = books.book_id
+            WHERE stats_book.borrows > 0
+            ORDER BY stats_book.borrows DESC LIMIT ?
+        """, (top,)).fetchall()
+        most_viewed = conn.execute("""
+            SELECT stats_book.book_id, books.title, stats_book.views
+            FROM stats_book LEFT JOIN books ON stats_book.book_id = books.book_id
+            WHERE stats_book.views > 0
+            ORDER BY stats_book.views DESC LIMIT ?
+        """, (top,)).fetchall()
+        by_day = conn.execute(
+            "SELECT day, borrows, logins FROM stats_day ORDER BY day DESC LIMIT ?", (days,)
+        ).fetchall()
+        by_department = conn.execute(
+            "SELECT department, borrows FROM stats_department ORDER BY borrows DESC"
+        ).fetchall()
+        return {
+            "top_borrowed": [dict(r) for r in top_borrowed],
+            "most_viewed": [dict(r) for r in most_viewed],
+            "by_day": [dict(r) for r in by_day],
+            "by_department": [dict(r) for r in by_department]
+        }
+    except Exception as e:
+        log.error("STATS ERROR: %s", e)
+        return {}
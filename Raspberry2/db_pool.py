@@ -0,0 +1,76 @@
+import queue
+import threading
+from concurrent.futures import Future
+import database
+
+class ConnectionManager:
+    """
+    Gives every thread its own read connection and funnels all writes
+    through one writer thread that owns the only write connection.
+    Readers never share cursors, and writes never interleave or hit
+    "database is locked".
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.local = threading.local()
+        self.readers = []  # Every read connection handed out (closed on shutdown)
+        self.readers_lock = threading.Lock()
+        self.writes = queue.Queue()
+        self.closed = False  # Set (under closing_lock) once the writer has been told to stop
+        self.closing_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._writer_loop, name="db-writer", daemon=True)
+        self.writer.start()
+
+    def reader(self):
+        """This thread's read-only connection (opened on first use)"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = database.db_connect(self.path, read_only=True)
+            self.local.conn = conn
+            with self.readers_lock:
+                self.readers.append(conn)
+        return conn
+
+    def read(self, func, *args):
+        """Runs func(conn, *args) on this thread's read connection"""
+        return func(self.reader(), *args)
+
+    def write(self, func, *args):
+        """Runs func(conn, *args) on the writer thread and waits for its result"""
+        future = Future()
+        with self.closing_lock:
+            if self.closed:
+                raise RuntimeError("ConnectionManager is closed")
+            self.writes.put((func, args, future))
+        return future.result()
+
+    def writer_depth(self):
+        """Writes waiting for the writer thread"""
+        return self.writes.qsize()
+
+    def close(self):
+        with self.closing_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.writes.put(None)  # Writes queued before this still run
+        self.writer.join(5)
+        with self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers.clear()
+
+    def _writer_loop(self):
+        conn = database.db_connect(self.path)
+        while True:
+            job = self.writes.get()
+            if job is None:
+                break
+            func, args, future = job
+            try:
+                future.set_result(func(conn, *args))
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                future.set_exception(e)
+        conn.close()
@@ -0,0 +1,147 @@
+import threading
+import time
+import database
+
+USER_QUERY = "SELECT user_id, name, role, current_book_id, interest FROM users"
+BOOK_QUERY = "SELECT book_id, title, author, genre, description, status FROM books"
+
+class CardDirectory:
+    """
+    In-memory map of card ID -> user or book, loaded at startup.
+    resolve() answers a scan with the same dict as database.scan_id without
+    touching SQLite. Borrow/return write through to it, catalog edits
+    arrive from the catalog snapshot via on_catalog_change(), and user edits
+    are read from user_changes by refresh(). IDs that matched nothing are
+    remembered for unknown_ttl seconds, so repeated bad scans don't hit SQLite.
+    """
+    MAX_UNKNOWN = 1024  # Remembered unknown IDs (expired ones are dropped first)
+
+    def __init__(self, db, unknown_ttl=10):
+        self.db = db  # ConnectionManager
+        self.lock = threading.Lock()
+        self.users = {}  # user_id -> user row (dict)
+        self.books = {}  # book_id -> book row (dict)
+        self.user_version = 0  # Last user_changes seq applied
+        self.unknown_ttl = unknown_ttl
+        self.unknown = {}  # card_id -> monotonic time its "not found" expires
+        self.load()
+
+    def load(self):
+        conn = self.db.reader()
+        # Read the version first: a change that lands in between is simply re-applied later
+        version = self._user_version(conn)
+        users = conn.execute(USER_QUERY).fetchall()
+        books = conn.execute(BOOK_QUERY).fetchall()
+        with self.lock:
+            self.users = {u["user_id"]: dict(u) for u in users}
+            self.books = {b["book_id"]: dict(b) for b in books}
+            self.user_version = version
+            self.unknown.clear()
+
+    def refresh(self):
+        """Applies pending user_changes (edits made outside the server)"""
+        conn = self.db.reader()
+        changes = conn.execute(
+            "SELECT seq, user_id, op FROM user_changes WHERE seq > ? ORDER BY seq", (self.user_version,)
+        ).fetchall()
+        if not changes:
+            return
+        if any(c["op"] == "reload" for c in changes):
+            self.load()
+            return
+        for user_id in {c["user_id"] for c in changes}:
+            self._reload_user(conn, user_id)
+        self.user_version = changes[-1]["seq"]
+
+    def resolve(self, card_id):
+        """Same result as database.scan_id(conn, card_id)"""
+        with self.lock:
+            user = self.users.get(card_id)
+            if user:
+                return {
+                    "status": "success",
+                    "type": "login",
+                    "user": user["name"],
+                    "role": user["role"],
+                    "user_id": user["user_id"],
+                    "interest": user["interest"],
+                    "current_book_id": user["current_book_id"]
+                }
+            book = self.books.get(card_id)
+            if book:
+                return {
+                    "status": "success",
+                    "type": "book_scan",
+                    "id": book["book_id"],
+                    "title": book["title"],
+                    "author": book["author"],
+                    "desc": book["description"],
+                    "status_book": book["status"],
+                }
+
+            expires = self.unknown.get(card_id)
+            if expires is not None and expires > time.monotonic():
+                return {"status": "error", "message": "Unknown ID"}
+
+        # Miss: maybe a card added since the last refresh. Ask SQLite once per unknown_ttl.
+        result = self.db.read(database.scan_id, card_id)
+        if result.get("status") == "success":
+            self._reload_card(card_id)
+        else:
+            self._remember_unknown(card_id)
+        return result
+
+    # --- WRITE-THROUGH ---
+    def set_borrowed(self, user_id, book_id):
+        with self.lock:
+            if user_id in self.users:
+                self.users[user_id]["current_book_id"] = book_id
+            if book_id in self.books:
+                self.books[book_id]["status"] = "borrowed"
+
+    def set_returned(self, user_id, book_id):
+        with self.lock:
+            if user_id in self.users:
+                self.users[user_id]["current_book_id"] = None
+            if book_id in self.books:
+                self.books[book_id]["status"] = "available"
+
+    def on_catalog_change(self, book_ids, version=None):
+        """Catalog snapshot listener: book_ids changed, or None after a full reload"""
+        if book_ids is None:
+            self.load()
+            return
+        for book_id in book_ids:
+            self._reload_card(book_id)
+
+    def _reload_card(self, card_id):
+        conn = self.db.reader()
+        self._reload_user(conn, card_id)
+        book = conn.execute(f"{BOOK_QUERY} WHERE book_id=?", (card_id,)).fetchone()
+        with self.lock:
+            if book:
+                self.books[card_id] = dict(book)
+            else:
+                self.books.pop(card_id, None)
+            self.unknown.pop(card_id, None)
+
+    def _reload_user(self, conn, user_id):
+        user = conn.execute(f"{USER_QUERY} WHERE user_id=?", (user_id,)).fetchone()
+        with self.lock:
+            if user:
+                self.users[user_id] = dict(user)
+            else:
+                self.users.pop(user_id, None)
+            self.unknown.pop(user_id, None)
+
+    def _remember_unknown(self, card_id):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.unknown) >= self.MAX_UNKNOWN:
+                self.unknown = {k: t for k, t in self.unknown.items() if t > now}
+                if len(self.unknown) >= self.MAX_UNKNOWN:
+                    self.unknown.clear()
+            self.unknown[card_id] = now + self.unknown_ttl
+
+    def _user_version(self, conn):
+        return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes").fetchone()[0]
@@ -0,0 +1,63 @@
+import queue
+import threading
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.logger import get_logger
+
+log = get_logger("dispatch")
+
+class Dispatcher:
+    """
+    Hands decoded MQTT messages to a fixed pool of worker threads.
+    Messages with the same key always go to the same worker, so one user's
+    actions run in the order they arrived while other users run in parallel.
+    """
+    def __init__(self, workers=4, queue_size=100):
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = []
+
+        for i, q in enumerate(self.queues):
+            thread = threading.Thread(target=self._worker_loop, args=(q,), name=f"dispatch-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, key, func, *args, timeout=None):
+        """
+        Queues func(*args) on the worker that owns 'key'.
+        Blocks up to 'timeout' seconds when that worker is full (backpressure).
+        Returns False if the job could not be queued in time (the caller counts it).
+        """
+        q = self.queues[hash(key) % len(self.queues)]
+        try:
+            q.put((func, args), timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def queue_depth(self):
+        """Total number of messages waiting across all workers"""
+        return sum(q.qsize() for q in self.queues)
+
+    def max_queue_depth(self):
+        """Backlog of the busiest worker (one hot key can fill its queue while the total looks low)"""
+        return max(q.qsize() for q in self.queues)
+
+    def stop(self, timeout=5):
+        """Lets every worker finish its queue, then stops the threads"""
+        for q in self.queues:
+            q.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _worker_loop(self, q):
+        while True:
+            job = q.get()
+            if job is None:
+                break
+            func, args = job
+            try:
+                func(*args)
+            except Exception:
+                log.exception("DISPATCH ERROR")
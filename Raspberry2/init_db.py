@@ -1,9 +1,12 @@
+import os
 import sqlite3
+import importer
 
 DB = "library.db"
+SEED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seed")
 
-def setup_db():
-    conn = sqlite3.connect(DB)
+def create_schema(conn):
+    """Creates every table/trigger the server needs. Safe to run on an existing DB."""
     c = conn.cursor()
 
     # --- USERS ---
@@ -41,33 +44,177 @@ def setup_db():
         )
     """)
 
-    # Users
-    users = [
-        ("1045542929320", "Alice",  21, "Science",      "Sci-Fi",       "admin",  None),
-        ("152089854730",  "Bob",    20, "Arts",         "History",      "client", None),
-        ("907835540408",  "John",   22, "Science",      "Nature",       "client", None),
-        ("151533650804",  "Arthur", 23, "Engineering",  "Mathematics",  "client", None),
-        ("702381884176",  "Mary",   21, "Sports",       "Sports",       "client", None),
-    ]
+    # --- CATALOG CHANGES ---
+    # Every insert/edit/delete of a book gets a sequence number.
+    # MAX(seq) is the catalog version (used to invalidate AI caches).
+    # Status changes (borrow/return) don't touch the catalog version.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id TEXT,
+            op TEXT NOT NULL
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_catalog_insert AFTER INSERT ON books
+        BEGIN
+            INSERT INTO catalog_changes (book_id, op) VALUES (NEW.book_id, 'upsert');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_catalog_update
+        AFTER UPDATE OF book_id, title, author, genre, description ON books
+        BEGIN
+            INSERT INTO catalog_changes (book_id, op)
+                SELECT OLD.book_id, 'delete' WHERE OLD.book_id <> NEW.book_id;
+            INSERT INTO catalog_changes (book_id, op) VALUES (NEW.book_id, 'upsert');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS books_catalog_delete AFTER DELETE ON books
+        BEGIN
+            INSERT INTO catalog_changes (book_id, op) VALUES (OLD.book_id, 'delete');
+        END
+    """)
+    # --- USER CHANGES ---
+    # Same idea for the server's in-memory card directory: edits to users made outside
+    # the server (imports, admin tools) are picked up by sequence number.
+    # current_book_id changes (borrow/return) are written through by the server itself.
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            op TEXT NOT NULL
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_directory_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op) VALUES (NEW.user_id, 'upsert');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_directory_update
+        AFTER UPDATE OF user_id, name, role, interest ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op)
+                SELECT OLD.user_id, 'delete' WHERE OLD.user_id <> NEW.user_id;
+            INSERT INTO user_changes (user_id, op) VALUES (NEW.user_id, 'upsert');
+        END
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_directory_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO user_changes (user_id, op) VALUES (OLD.user_id, 'delete');
+        END
+    """)
+    # --- LOG INDEXES ---
+    c.execute("CREATE INDEX IF NOT EXISTS idx_log_timestamp ON log (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_log_user ON log (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_log_book ON log (book_id)")
+
+    # --- USAGE STATS ---
+    # Summary tables kept up to date by a trigger on log, so dashboards never scan the log
+    backfill = not c.execute("SELECT 1 FROM sqlite_master WHERE name='stats_book'").fetchone()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_book (
+            book_id TEXT PRIMARY KEY,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            views INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_book_borrows ON stats_book (borrows)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_book_views ON stats_book (views)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_day (
+            day TEXT PRIMARY KEY,
+            borrows INTEGER NOT NULL DEFAULT 0,
+            logins INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_department (
+            department TEXT PRIMARY KEY,
+            borrows INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS log_stats AFTER INSERT ON log
+        BEGIN
+            INSERT INTO stats_book (book_id, borrows, views)
+                SELECT NEW.book_id, NEW.action = 'borrowed', NEW.action = 'viewed_book'
+                WHERE NEW.book_id IS NOT NULL AND NEW.action IN ('borrowed', 'viewed_book')
+                ON CONFLICT (book_id) DO UPDATE SET
+                    borrows = borrows + excluded.borrows, views = views + excluded.views;
+            INSERT INTO stats_day (day, borrows, logins)
+                SELECT date(NEW.timestamp), NEW.action = 'borrowed', NEW.action = 'login'
+                WHERE NEW.action IN ('borrowed', 'login')
+                ON CONFLICT (day) DO UPDATE SET
+                    borrows = borrows + excluded.borrows, logins = logins + excluded.logins;
+            INSERT INTO stats_department (department, borrows)
+                SELECT department, 1 FROM users
+                WHERE user_id = NEW.user_id AND NEW.action = 'borrowed' AND department IS NOT NULL
+                ON CONFLICT (department) DO UPDATE SET borrows = borrows + 1;
+        END
+    """)
+    # --- PRECOMPUTED RECOMMENDATIONS (filled by precompute.py, read at login) ---
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS recommendations (
+            interest TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            book_id TEXT NOT NULL,
+            reason TEXT,
+            catalog_version INTEGER,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (interest, rank)
+        )
+    """)
+    # --- PROCESSED REQUESTS ---
+    # msg_id -> reply of each borrow/return, written in the same transaction,
+    # so a request replayed from a terminal's outbox is never applied twice (even across restarts)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            msg_id TEXT PRIMARY KEY,
+            reply TEXT NOT NULL,
+            created DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    if backfill:
+        # First run on an existing DB: count what is already in the log
+        c.execute("""
+            INSERT INTO stats_book (book_id, borrows, views)
+            SELECT book_id, SUM(action = 'borrowed'), SUM(action = 'viewed_book') FROM log
+            WHERE book_id IS NOT NULL AND action IN ('borrowed', 'viewed_book')
+            GROUP BY book_id
+        """)
+        c.execute("""
+            INSERT INTO stats_day (day, borrows, logins)
+            SELECT date(timestamp), SUM(action = 'borrowed'), SUM(action = 'login') FROM log
+            WHERE action IN ('borrowed', 'login')
+            GROUP BY date(timestamp)
+        """)
+        c.execute("""
+            INSERT INTO stats_department (department, borrows)
+            SELECT users.department, COUNT(*) FROM log
+            JOIN users ON log.user_id = users.user_id
+            WHERE log.action = 'borrowed' AND users.department IS NOT NULL
+            GROUP BY users.department
+        """)
+    conn.commit()
+
+def upgrade_db(path=DB):
+    """Adds tables/triggers introduced after the DB was first created"""
+    conn = sqlite3.connect(path)
+    create_schema(conn)
+    conn.close()
 
-    # Books
-    books = [
-        ("770095055811", "Dune", "Frank Herbert", "Sci-Fi", "Epic sci-fi on Arrakis.", "available"),
-        ("840892482320", "Sapiens", "Yuval Noah Harari", "History", "A brief history of humankind.", "available"),
-        ("700852798363", "The Hidden Life of Trees", "Peter Wohlleben", "Nature", "How forests work and communicate.", "available"),
-        ("702212146116", "How Not to Be Wrong", "Jordan Ellenberg", "Mathematics", "Math thinking for real life.", "available"),
-        ("427889591285", "Moneyball", "Michael Lewis", "Sports", "Data-driven sports revolution.", "available"),
-    ]
-    # Insert initial data if not exists (ignoring duplicates)
-    c.executemany("""
-        INSERT OR IGNORE INTO users (user_id, name, age, department, interest, role, current_book_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, users)
+def setup_db(path=DB):
+    conn = sqlite3.connect(path)
+    create_schema(conn)
 
-    c.executemany("""
-        INSERT OR IGNORE INTO books (book_id, title, author, genre, description, status)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, books)
+    # Demo users and books (INSERT OR IGNORE, so existing rows are kept)
+    for table in ("users", "books"):
+        importer.import_file(conn, table, os.path.join(SEED_DIR, f"{table}.csv"), progress=False)
 
     conn.commit()
     conn.close()
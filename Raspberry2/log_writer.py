@@ -0,0 +1,78 @@
+import threading
+import time
+import database
+from common.logger import get_logger
+from common.metrics import metrics, SIZE_BUCKETS
+
+log = get_logger("log_writer")
+
+metrics.describe("library_log_batch_rows", "Activity log rows written per batch")
+metrics.describe("library_log_flush_seconds", "Time to write one batch of activity log rows")
+
+class LogWriter:
+    """
+    Write-behind buffer for the activity log.
+    Rows are queued in memory and written in one transaction (one fsync)
+    once batch_size rows are waiting or flush_interval seconds have passed.
+    """
+    def __init__(self, db, batch_size=50, flush_interval=1.0):
+        self.db = db  # ConnectionManager: batches go through its single writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.cond = threading.Condition()
+        self.flush_lock = threading.Lock()  # One flush at a time, so batches are written in order
+        self.running = True
+
+        self.thread = threading.Thread(target=self._flush_loop, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def log(self, user_id, action, book_id=None):
+        """Queues a log row. The timestamp is taken now, not at flush time."""
+        row = (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()), user_id, book_id, action)
+        with self.cond:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.batch_size:
+                self.cond.notify()
+
+    def flush(self):
+        """Writes everything queued so far (call before reading the log)"""
+        with self.flush_lock:
+            # Taken under flush_lock: a second flusher can't write newer rows before these
+            with self.cond:
+                rows, self.buffer = self.buffer, []
+            if not rows:
+                return
+            started = time.perf_counter()
+            try:
+                self.db.write(database.log_actions, rows)
+            except Exception:
+                # Put the rows back so the next flush retries them
+                with self.cond:
+                    self.buffer[:0] = rows
+                raise
+            elapsed = time.perf_counter() - started
+
+        metrics.observe("library_log_batch_rows", len(rows), buckets=SIZE_BUCKETS)
+        metrics.observe("library_log_flush_seconds", elapsed)
+        log.debug("LOG FLUSH: %d rows in %.1fms", len(rows), elapsed * 1000)
+
+    def close(self):
+        """Stops the background thread and writes whatever is left"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(5)
+        self.flush()
+
+    def _flush_loop(self):
+        while True:
+            with self.cond:
+                if self.running and len(self.buffer) < self.batch_size:
+                    self.cond.wait(self.flush_interval)
+                if not self.running:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                log.exception("LOG ERROR")
@@ -1,4 +1,7 @@
 import json
+import logging
+import threading
+import time
 import paho.mqtt.client as mqtt
 import sys
 import os
@@ -6,30 +9,110 @@ import os
 # 1. SETUP PATHS
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from common import config
+from common.metrics import metrics
+from common.logger import setup_logging, shutdown_logging, get_logger, action_logger
+from common import wire
 from controller import LibraryController
+from dispatcher import Dispatcher
+from catalog_feed import CatalogFeed
 import init_db
 
+setup_logging()
+log = get_logger("server")
+
 # 2. AUTO-INIT DB
 if not os.path.exists(config.DB_PATH):
-    print("Initializing Database...")
-    init_db.setup_db()
+    log.info("Initializing Database...")
+    init_db.setup_db(config.DB_PATH)
+init_db.upgrade_db(config.DB_PATH)
 
-# 3. INIT CONTROLLER
+# 3. INIT CONTROLLER + WORKER POOL
 ctrl = LibraryController()
+dispatcher = Dispatcher(config.DISPATCH_WORKERS, config.DISPATCH_QUEUE_SIZE)
+# Retained catalog snapshot + deltas for the terminals' local caches (started in main)
+catalog_feed = CatalogFeed(ctrl.ai.catalog)
+
+# 3b. METRICS (sampled each time they are exported)
+metrics.describe("library_mqtt_messages_total", "MQTT requests handled, by action")
+metrics.describe("library_mqtt_seconds", "Receive-to-reply time per MQTT action (includes worker queue wait)")
+metrics.describe("library_mqtt_busy_total", "Requests rejected because the worker queue was full")
+metrics.describe("library_mqtt_duplicates_total", "Replayed requests answered from the dedup cache")
+metrics.gauge("library_dispatch_queue_depth", dispatcher.queue_depth, "Messages waiting for a dispatcher worker")
+metrics.gauge("library_dispatch_queue_max_depth", dispatcher.max_queue_depth, "Messages waiting for the busiest dispatcher worker")
+metrics.gauge("library_ai_queue_depth", ctrl.ai_jobs.queue_depth, "AI jobs waiting for an AI worker")
+metrics.gauge("library_ai_in_flight", lambda: len(ctrl.ai_jobs.in_flight), "Distinct AI prompts queued or running")
+metrics.counter("library_ai_cache_hits_total", lambda: ctrl.ai.cache.hits, "Recommendation cache hits")
+metrics.counter("library_ai_cache_misses_total", lambda: ctrl.ai.cache.misses, "Recommendation cache misses")
+metrics.gauge("library_ai_cache_entries", lambda: len(ctrl.ai.cache), "Answers in the recommendation cache")
+metrics.gauge("library_gemini_circuit_open", lambda: int(ctrl.ai.client.breaker.state != "closed"), "1 while Gemini calls are being skipped")
+metrics.gauge("library_db_write_queue_depth", ctrl.db.writer_depth, "Writes waiting for the DB writer thread")
+metrics.gauge("library_log_buffer_rows", lambda: len(ctrl.log_writer.buffer), "Log rows waiting for the next batch")
+metrics.gauge("library_active_sessions", lambda: len(ctrl.sessions), "Logged-in sessions")
+metrics.gauge("library_threads", threading.active_count, "Live Python threads")
 
 # 4. MQTT LOGIC
+# Actions the server understands; anything else is logged/counted as "unknown"
+# (metric labels and logger names stay bounded whatever clients send)
+ACTIONS = ("scan", "borrow", "return", "get_logs", "get_stats", "chat", "logout", "view", "catalog_sync")
+# Never written to the console, whatever the log level
+SECRET_FIELDS = ("token", "_wire")
+
+def action_name(payload):
+    """The action, or "unknown" if the server doesn't know it"""
+    action = payload.get("action")
+    return action if action in ACTIONS else "unknown"
+
+def loggable(data):
+    """A message body safe to log: no session tokens, no log rows (up to 50 would flood the console)"""
+    shown = {k: v for k, v in data.items() if k not in SECRET_FIELDS and k != "logs"}
+    if "logs" in data:
+        shown["logs"] = f"<{len(data['logs'])} rows>"
+    return shown
+
 def on_message(client, userdata, msg):
+    """Runs on paho's network thread: decode, then hand off to a worker"""
+    try:
+        received = time.perf_counter()
+        payload = wire.decode(msg.payload)
+        payload["_wire"] = wire.topic_format(msg.topic)  # Reply in the format the terminal used
+        alog = action_logger(action_name(payload))
+        if alog.isEnabledFor(logging.DEBUG):
+            alog.debug("RECEIVED %s", loggable(payload))
+
+        # Same terminal -> same worker, so its actions stay in order
+        key = payload.get("terminal") or payload.get("user") or payload.get("id")
+        if not dispatcher.submit(key, process_message, client, payload, received, timeout=config.DISPATCH_SUBMIT_TIMEOUT):
+            metrics.inc("library_mqtt_busy_total")
+            log.warning("BUSY: dropped %s (queue depth %d)", payload.get("action"), dispatcher.queue_depth())
+            send_reply(client, payload, {
+                "status": "error",
+                "user": payload.get("user"),
+                "message": "Server busy, please try again"
+            })
+
+    except Exception:
+        log.exception("Bad message on %s", msg.topic)
+
+def send_reply(client, request, data):
+    """Publishes to the requesting terminal's own topic, tagged with its correlation ID"""
+    if request.get("corr_id") is not None:
+        data["corr_id"] = request["corr_id"]
+    terminal = request.get("terminal")
+    # Old clients without a terminal ID still listen on the broadcast topic
+    topic = config.reply_topic(terminal) if terminal else config.TOPIC_DISPLAY
+    client.publish(topic, wire.encode(data, request.get("_wire", wire.JSON)), qos=1)
+
+def process_message(client, payload, received=None):
+    """Runs on a dispatcher worker thread"""
+    action = payload.get("action")
+    alog = action_logger(action_name(payload))
+    response = None
     try:
-        payload = json.loads(msg.payload.decode())
-        print(f"RECEIVED: {payload}")
-        
-        action = payload.get("action")
-        response = None
-        
         # Callback for async AI responses
         def async_reply(data):
-            print(f"ASYNC: {data}")
-            client.publish(config.TOPIC_DISPLAY, json.dumps(data))
+            if alog.isEnabledFor(logging.DEBUG):
+                alog.debug("ASYNC %s", loggable(data))
+            send_reply(client, payload, data)
 
         # ROUTING
         if action == "scan":
@@ -39,34 +122,89 @@ def on_message(client, userdata, msg):
         elif action == "return":
             response = ctrl.handle_return(payload)
         elif action == "get_logs":
-            response = ctrl.handle_logs()
+            response = ctrl.handle_logs(payload, async_reply)
+        elif action == "get_stats":
+            response = ctrl.handle_stats()
         elif action == "chat":
             ctrl.handle_chat(payload, async_reply) 
         elif action == "logout":
-            if payload.get("user") in ctrl.active_sessions:
-                del ctrl.active_sessions[payload.get("user")]
-                print("Logged out")
+            ctrl.handle_logout(payload)
+        elif action == "view":
+            ctrl.handle_view(payload)
+        elif action == "catalog_sync":
+            response = catalog_feed.snapshot()
+
+        # Replay of a request already applied (the DB keeps msg_id -> reply): answered again, nothing changed
+        if response and response.pop("duplicate", False):
+            metrics.inc("library_mqtt_duplicates_total", action=action_name(payload))
+            alog.info("DUPLICATE %s (already handled)", payload.get("msg_id"))
 
         # IMMEDIATE RESPONSE
         if response:
-            # Create a copy strictly for printing to avoid console flood
-            print_data = response.copy()
-            
-            if print_data.get("type") == "log_data":
-                count = len(print_data.get("logs", []))
-                print_data["logs"] = f"<Hiding {count} log entries for console clarity>"
+            if alog.isEnabledFor(logging.DEBUG):
+                alog.debug("SENDING %s", loggable(response))
+            send_reply(client, payload, response)
+
+    except Exception:
+        alog.exception("Failed to handle %s", action)
+    finally:
+        elapsed = time.perf_counter() - received if received is not None else None
+        metrics.inc("library_mqtt_messages_total", action=action_name(payload))
+        if elapsed is not None:
+            metrics.observe("library_mqtt_seconds", elapsed, action=action_name(payload))
+        # One line per request; the extra= fields are only built when INFO is on for this action
+        if alog.isEnabledFor(logging.INFO):
+            outcome = (response or {}).get("code") or (response or {}).get("status", "ok")
+            alog.info("%s -> %s", action_name(payload), outcome, extra={
+                "terminal": payload.get("terminal"),
+                "corr_id": payload.get("corr_id"),
+                "ms": round(elapsed * 1000, 1) if elapsed is not None else None
+            })
 
-            print(f"SENDING: {print_data}")
-            client.publish(config.TOPIC_DISPLAY, json.dumps(response))
+def report_metrics(client):
+    """Every METRICS_INTERVAL: JSON snapshot on library/metrics + Prometheus text file"""
+    while True:
+        time.sleep(config.METRICS_INTERVAL)
+        try:
+            client.publish(config.TOPIC_METRICS, json.dumps(metrics.snapshot()))
+            if config.METRICS_FILE:
+                tmp = config.METRICS_FILE + ".tmp"
+                with open(tmp, "w") as f:
+                    f.write(metrics.render_prometheus())
+                os.replace(tmp, config.METRICS_FILE)
+        except Exception:
+            log.exception("METRICS export failed")
 
-    except Exception as e:
-        print(f"ERROR: {e}")
+def on_connect(client, userdata, flags, reason_code, properties):
+    if reason_code.is_failure:
+        log.error("Broker refused connection: %s", reason_code)
+        return
+    # QoS 1 + persistent session: requests published while we were down are delivered now
+    client.subscribe(config.TOPIC_SCAN, qos=1)
+    client.subscribe(config.TOPIC_SCAN_BINARY, qos=1)
+    log.info("Broker connected, subscribed to %s", config.TOPIC_SCAN)
 
 # 5. START SERVER
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-client.on_message = on_message
-client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
-client.subscribe(config.TOPIC_SCAN)
+def main():
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="library-server", clean_session=False)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.reconnect_delay_set(config.MQTT_RECONNECT_MIN, config.MQTT_RECONNECT_MAX)
+    client.connect(config.MQTT_BROKER, config.MQTT_PORT, 60)
+    catalog_feed.start(lambda topic, data: client.publish(topic, json.dumps(data), qos=1, retain=True))
+    threading.Thread(target=report_metrics, args=(client,), name="metrics", daemon=True).start()
+
+    log.info("SERVER LISTENING ON: %s (%d workers)", config.TOPIC_SCAN, config.DISPATCH_WORKERS)
+    try:
+        client.loop_forever()
+    finally:
+        shutdown()
+
+def shutdown():
+    dispatcher.stop()
+    ctrl.close()
+    shutdown_logging()
 
-print(f"SERVER LISTENING ON: {config.TOPIC_SCAN}")
-client.loop_forever()
\ No newline at end of file
+# Importing this module (e.g. from the benchmarks) doesn't connect to a broker
+if __name__ == "__main__":
+    main()
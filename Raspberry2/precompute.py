@@ -0,0 +1,133 @@
+"""
+Off-peak batch job: ranked book picks for every distinct reader interest,
+stored in the recommendations table so a login can show a real book at once.
+
+    python3 precompute.py                  # e.g. nightly from cron: 0 3 * * *
+    python3 precompute.py --batch 20
+
+Interests are packed PRECOMPUTE_BATCH to a Gemini request, each with its
+own BM25 shortlist in the prompt. Anything Gemini doesn't answer (errors,
+unknown ids, short lists) is filled from books that actually match the
+interest (BM25 hits). An interest with no picks at all gets nothing stored,
+so a login with it asks Gemini live.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import config
+from common.gemini_client import GeminiClient, GeminiError
+from common.logger import setup_logging, shutdown_logging, get_logger
+import database
+from db_pool import ConnectionManager
+from catalog import CatalogSnapshot
+from ai_service import normalize_prompt
+
+log = get_logger("precompute")
+
+def distinct_interests(conn):
+    rows = conn.execute("SELECT DISTINCT interest FROM users WHERE interest IS NOT NULL AND interest <> ''").fetchall()
+    return sorted({normalize_prompt(row["interest"]) for row in rows})
+
+def build_prompt(catalog, interests):
+    shortlist = []
+    for interest in interests:
+        for book_id in catalog.shortlist(interest, config.AI_SHORTLIST_SIZE):
+            if book_id not in shortlist:
+                shortlist.append(book_id)
+    return f"""
+        You are a Library System.
+        REAL CATALOG: {catalog.to_json(shortlist)}
+        READER INTERESTS: {json.dumps(interests)}
+
+        TASK:
+        1. For EACH interest, pick the {config.PRECOMPUTE_TOP} best book IDs from the catalog, best first.
+        2. Write a reason for each (max 10 words).
+        3. Return strictly valid JSON with every interest as a key.
+
+        JSON FORMAT: {{ "<interest>": [{{ "id": "...", "reason": "..." }}] }}
+        """
+
+def ask_gemini(client, catalog, interests):
+    """{interest: [(book_id, reason), ...]} for whatever Gemini answered validly"""
+    payload = {"contents": [{"parts": [{"text": build_prompt(catalog, interests)}]}]}
+    data = client.generate(payload)
+    raw = data['candidates'][0]['content']['parts'][0]['text']
+    answer = json.loads(raw.replace("```json", "").replace("```", "").strip())
+    if not isinstance(answer, dict):
+        return {}
+    picks = {}
+    for interest in interests:
+        entries = answer.get(interest) or []
+        picks[interest] = [
+            (e["id"], e.get("reason", "")) for e in entries
+            if isinstance(e, dict) and catalog.get(e.get("id"))
+        ]
+    return picks
+
+def complete(catalog, interest, picks):
+    """Dedups, then tops up to PRECOMPUTE_TOP from real BM25 matches (never arbitrary books)"""
+    result, seen = [], set()
+    for book_id, reason in picks:
+        if book_id not in seen:
+            result.append((book_id, reason))
+            seen.add(book_id)
+    for book_id in catalog.search(interest, config.PRECOMPUTE_TOP * 2):
+        if len(result) >= config.PRECOMPUTE_TOP:
+            break
+        if book_id not in seen:
+            result.append((book_id, f"Matches your interest in {interest}."))
+            seen.add(book_id)
+    return result[:config.PRECOMPUTE_TOP]
+
+def run(db, client, batch_size):
+    catalog = CatalogSnapshot(db)
+    interests = db.read(distinct_interests)
+    log.info("PRECOMPUTE: %d interests, %d books, batches of %d", len(interests), len(catalog.books), batch_size)
+
+    started = time.perf_counter()
+    requests, fallbacks, empty = 0, 0, 0
+    for i in range(0, len(interests), batch_size):
+        batch = interests[i:i + batch_size]
+        try:
+            requests += 1
+            answered = ask_gemini(client, catalog, batch)
+        except (GeminiError, ValueError, KeyError, IndexError) as e:
+            log.warning("Batch %d failed (%s): using local matches", i // batch_size + 1, e)
+            answered = {}
+        results = {}
+        for interest in batch:
+            if not answered.get(interest):
+                fallbacks += 1
+            results[interest] = complete(catalog, interest, answered.get(interest, []))
+            if not results[interest]:
+                empty += 1  # Stored as no picks: logins with it ask Gemini live
+        # Each batch is committed on its own, so a crash halfway keeps what's done
+        db.write(database.save_recommendations, results, catalog.version)
+
+    log.info("PRECOMPUTE: done in %.1fs, %d Gemini request(s), %d interest(s) from local matches only, %d with no picks",
+             time.perf_counter() - started, requests, fallbacks, empty)
+    return len(interests)
+
+def main():
+    import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=config.DB_PATH)
+    parser.add_argument("--batch", type=int, default=config.PRECOMPUTE_BATCH, help="interests per Gemini request")
+    args = parser.parse_args()
+
+    setup_logging()
+    init_db.upgrade_db(args.db)
+    db = ConnectionManager(args.db)
+    try:
+        run(db, GeminiClient(), args.batch)
+    finally:
+        db.close()
+        shutdown_logging()
+
+if __name__ == "__main__":
+    main()
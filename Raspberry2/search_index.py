@@ -0,0 +1,73 @@
+import heapq
+import math
+import re
+from collections import Counter
+
+# Words that say nothing about which book fits
+STOPWORDS = {
+    "a", "an", "and", "are", "about", "book", "books", "for", "from", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "please", "recommend", "some", "something", "the", "to",
+    "want", "with", "you"
+}
+
+def tokenize(text):
+    return [t for t in re.findall(r"[a-z0-9]+", (text or "").lower()) if t not in STOPWORDS]
+
+class BM25Index:
+    """
+    Small in-process inverted index with BM25 ranking.
+    Documents can be added/removed one at a time, so it follows catalog edits
+    without a rebuild.
+    """
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc_id: term frequency}
+        self.doc_len = {}   # doc_id -> number of tokens
+        self.doc_terms = {} # doc_id -> distinct terms (for cheap removal)
+        self.total_len = 0
+
+    def add(self, doc_id, text):
+        if doc_id in self.doc_len:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self.doc_terms[doc_id] = list(counts)
+        self.doc_len[doc_id] = len(tokens)
+        self.total_len += len(tokens)
+
+    def remove(self, doc_id):
+        length = self.doc_len.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_len -= length
+        for term in self.doc_terms.pop(doc_id):
+            docs = self.postings[term]
+            del docs[doc_id]
+            if not docs:
+                del self.postings[term]
+
+    def clear(self):
+        self.postings.clear()
+        self.doc_len.clear()
+        self.doc_terms.clear()
+        self.total_len = 0
+
+    def search(self, query, k=10):
+        """Returns up to k (doc_id, score) pairs, best first"""
+        n = len(self.doc_len)
+        if not n:
+            return []
+        avg_len = self.total_len / n or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
@@ -0,0 +1,193 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from common.logger import get_logger
+
+log = get_logger("sessions")
+
+class SessionStore:
+    """
+    Login sessions keyed by an opaque random token, with an idle timeout.
+    Sessions are kept in last-used order, so the sweeper only ever looks at
+    the oldest one and each eviction is O(1). A JSON snapshot lets a restarted
+    server keep everyone logged in: it is rewritten soon after a login, logout
+    or expiry, while plain activity (last_seen) is only saved by the sweeper.
+    Ended sessions (logout or expiry) are remembered for `grace` seconds, so a
+    request a terminal queued while its session was live still counts after
+    an outage (see ended()).
+    """
+    def __init__(self, ttl=900, snapshot_path=None, sweep_interval=30, grace=0):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.sweep_interval = sweep_interval
+        self.grace = grace
+        self.sessions = OrderedDict()  # token -> session dict, least recently used first
+        self.ended_sessions = OrderedDict()  # token -> session dict + "ended" time, oldest first
+        self.lock = threading.Lock()
+        self.dirty = False    # Sessions added/removed since the last snapshot
+        self.touched = False  # Only last_seen changed since the last snapshot
+        self.changed = threading.Event()  # Wakes the sweeper to save right away
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, user_id, name, role, terminal=None):
+        """Starts a session and returns its token"""
+        token = secrets.token_urlsafe(16)
+        with self.lock:
+            self.sessions[token] = {
+                "user_id": user_id,
+                "user": name,
+                "role": role,
+                "terminal": terminal,
+                "last_seen": time.time()
+            }
+            self.dirty = True
+        self.changed.set()
+        return token
+
+    def get(self, token):
+        """Session for token (and marks it as used), or None if unknown/expired"""
+        if not token:
+            return None
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            now = time.time()
+            if now - session["last_seen"] > self.ttl:
+                self._end(token, session["last_seen"] + self.ttl)
+                self.dirty = True
+                self.changed.set()
+                return None
+            session["last_seen"] = now
+            self.sessions.move_to_end(token)
+            self.touched = True
+            return session
+
+    def peek(self, token):
+        """Like get(), but doesn't count as activity (for background checks)"""
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None or time.time() - session["last_seen"] > self.ttl:
+                return None
+            return session
+
+    def ended(self, token, queued_at):
+        """
+        Session for a request queued at queued_at (terminal clock, seconds) that arrives
+        after its session ended: returned if the session was still live then, else None
+        """
+        if not token or queued_at is None:
+            return None
+        with self.lock:
+            session = self.ended_sessions.get(token)
+            try:
+                if session is None or float(queued_at) > session["ended"]:
+                    return None
+            except (TypeError, ValueError):
+                return None
+            return session
+
+    def remove(self, token):
+        with self.lock:
+            if token in self.sessions:
+                self._end(token, time.time())
+                self.dirty = True
+                self.changed.set()
+
+    def _end(self, token, ended):
+        """Moves a live session to ended_sessions (caller holds the lock)"""
+        session = self.sessions.pop(token)
+        if self.grace > 0:
+            self.ended_sessions[token] = {**session, "ended": ended}
+
+    def sweep(self):
+        """Evicts idle sessions (oldest first, stops at the first live one)"""
+        cutoff = time.time() - self.ttl
+        evicted = 0
+        with self.lock:
+            while self.sessions:
+                token, session = next(iter(self.sessions.items()))
+                if session["last_seen"] > cutoff:
+                    break
+                self._end(token, session["last_seen"] + self.ttl)
+                evicted += 1
+            self._forget_ended()
+            if evicted:
+                self.dirty = True
+        return evicted
+
+    def _forget_ended(self):
+        # Kept in the order they were ended (an expiry is dated a little back), so stop at the first fresh one
+        cutoff = time.time() - self.grace
+        while self.ended_sessions and next(iter(self.ended_sessions.values()))["ended"] <= cutoff:
+            self.ended_sessions.popitem(last=False)
+
+    # --- PERSISTENCE ---
+    def save(self):
+        if not self.snapshot_path:
+            return
+        with self.lock:
+            data = {"sessions": list(self.sessions.items()), "ended": list(self.ended_sessions.items())}
+            self.dirty = self.touched = False
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.snapshot_path)  # Atomic: never a half-written snapshot
+
+    def restore(self):
+        """Loads the last snapshot; sessions that expired meanwhile count as ended"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        try:
+            with open(self.snapshot_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("SESSION RESTORE ERROR: %s", e)
+            return 0
+        if isinstance(data, list):
+            data = {"sessions": data, "ended": []}  # Snapshot from before ended sessions were kept
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for token, session in data["ended"]:
+                self.ended_sessions[token] = session
+            for token, session in sorted(data["sessions"], key=lambda item: item[1]["last_seen"]):
+                self.sessions[token] = session
+                if session["last_seen"] <= cutoff:
+                    self._end(token, session["last_seen"] + self.ttl)  # Expired while we were down
+            self.ended_sessions = OrderedDict(sorted(self.ended_sessions.items(), key=lambda item: item[1]["ended"]))
+            self._forget_ended()
+        return len(self.sessions)
+
+    # --- BACKGROUND SWEEPER ---
+    def start(self):
+        self.thread = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.changed.set()
+        if self.thread:
+            self.thread.join(5)
+        self.save()
+
+    def _sweep_loop(self):
+        while True:
+            # A login/logout wakes us early; otherwise sweep every sweep_interval
+            swept = not self.changed.wait(self.sweep_interval)
+            self.changed.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                if swept:
+                    self.sweep()
+                if self.dirty or (swept and self.touched):
+                    self.save()
+            except Exception:
+                log.exception("SESSION SWEEP ERROR")
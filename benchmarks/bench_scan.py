@@ -0,0 +1,68 @@
+"""
+Scan resolution benchmark: in-memory CardDirectory vs database.scan_id
+(which costs two queries for every book scan).
+
+    python3 benchmarks/bench_scan.py --users 5000 --books 50000 --scans 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, "Raspberry2"))
+import init_db
+import database
+from db_pool import ConnectionManager
+from directory import CardDirectory
+
+def build_db(path, n_users, n_books):
+    conn = sqlite3.connect(path)
+    init_db.create_schema(conn)
+    conn.executemany(
+        "INSERT INTO users (user_id, name, age, department, interest, role) VALUES (?, ?, 20, 'Science', 'Sci-Fi', 'client')",
+        ((f"U{i:09d}", f"User {i}") for i in range(n_users))
+    )
+    conn.executemany(
+        "INSERT INTO books (book_id, title, author, genre, description, status) VALUES (?, ?, 'Author', 'Sci-Fi', 'A book.', 'available')",
+        ((f"B{i:09d}", f"Book {i}") for i in range(n_books))
+    )
+    conn.commit()
+    conn.close()
+
+def run(label, resolve, ids):
+    started = time.perf_counter()
+    for card_id in ids:
+        resolve(card_id)
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<22} {elapsed / len(ids) * 1e6:8.2f} us/scan  {len(ids) / elapsed:10.0f} scans/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--books", type=int, default=50000)
+    parser.add_argument("--scans", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        build_db(path, args.users, args.books)
+        db = ConnectionManager(path)
+        conn = db.reader()
+        directory = CardDirectory(db)
+
+        user_ids = [f"U{random.randrange(args.users):09d}" for _ in range(args.scans)]
+        book_ids = [f"B{random.randrange(args.books):09d}" for _ in range(args.scans)]
+
+        for label, ids in (("User scans (login)", user_ids), ("Book scans", book_ids)):
+            print(f"{label}: {args.scans} scans, {args.users} users, {args.books} books")
+            run("database.scan_id", lambda card_id: database.scan_id(conn, card_id), ids)
+            run("CardDirectory.resolve", directory.resolve, ids)
+        db.close()
+
+if __name__ == "__main__":
+    main()
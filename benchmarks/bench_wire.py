@@ -0,0 +1,66 @@
+"""
+Wire format benchmark: JSON vs MessagePack (row dicts) vs MessagePack with
+columnar log batches, for the messages the terminals actually exchange.
+Run it on the Pi itself for ARM numbers (needs: pip3 install msgpack).
+
+    python3 benchmarks/bench_wire.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+from common import wire
+
+ACTIONS = ["login", "viewed_book", "borrowed", "returned"]
+
+def sample_messages():
+    book = {"id": "B001", "title": "Dune", "desc": "Desert planet, politics and prophecy.", "reason": "Matches your Sci-Fi interest."}
+    return {
+        "scan request": {"action": "scan", "id": "B001", "terminal": "pi-desk-1", "corr_id": 42, "token": "p9iXtIy4dcR_A_IipqNMUg"},
+        "login reply": {"status": "success", "type": "login", "user": "Alice Smith", "role": "client",
+                        "token": "p9iXtIy4dcR_A_IipqNMUg", "book": book, "corr_id": 42},
+        "chat reply": {"status": "success", "type": "chat_response", "book": book, "corr_id": 43},
+        "log_data (50 rows)": {"type": "log_data", "corr_id": 44, "logs": [
+            {"timestamp": f"2026-10-18 09:{i // 60:02d}:{i % 60:02d}", "name": f"User {i % 7}",
+             "title": f"Book title {i % 13}", "action": ACTIONS[i % len(ACTIONS)]}
+            for i in range(50)
+        ]}
+    }
+
+def encode_rows(data):
+    """MessagePack without the columnar step, for comparison"""
+    return wire.msgpack.packb(data, use_bin_type=True)
+
+def time_per_call(func, arg, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    formats = [("json", lambda d: wire.encode(d, wire.JSON))]
+    if wire.available(wire.MSGPACK):
+        formats += [("msgpack rows", encode_rows), ("msgpack columnar", lambda d: wire.encode(d, wire.MSGPACK))]
+    else:
+        print("msgpack not installed: JSON only (pip3 install msgpack)")
+
+    print(f"{'message':<20}{'format':<18}{'bytes':>7}{'encode us':>11}{'decode us':>11}")
+    for name, message in sample_messages().items():
+        for label, encode in formats:
+            raw = encode(message)
+            raw = raw.encode() if isinstance(raw, str) else raw
+            assert wire.decode(raw) == json.loads(json.dumps(message)), label
+            enc = time_per_call(encode, message, args.iterations)
+            dec = time_per_call(wire.decode, raw, args.iterations)
+            print(f"{name:<20}{label:<18}{len(raw):>7}{enc:>11.2f}{dec:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Checks common/gemini_client.py against local stub servers (mock_gemini.py):
+retries, read deadline, circuit breaker (open, fail fast, half-open trial,
+close again) and streaming. No API key or internet needed.
+
+    python3 benchmarks/check_gemini_client.py
+"""
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+import mock_gemini
+from common.gemini_client import GeminiClient, GeminiError, CircuitOpenError, CircuitBreaker
+
+PAYLOAD = {"contents": [{"parts": [{"text": 'REAL CATALOG: [{"id": "B1"}]'}]}]}
+
+def check(name, ok, problems):
+    print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    if not ok:
+        problems.append(name)
+
+def calls(client, n):
+    """Outcome class name of n generate() calls"""
+    outcomes = []
+    for _ in range(n):
+        try:
+            client.generate(PAYLOAD)
+            outcomes.append("ok")
+        except GeminiError as e:
+            outcomes.append(type(e).__name__)
+    return outcomes
+
+def main():
+    healthy, healthy_url = mock_gemini.start(latency=0.0)
+    failing, failing_url = mock_gemini.start(latency=0.0, error_rate=1.0)
+    slow, slow_url = mock_gemini.start(latency=0.5)
+    problems = []
+
+    client = GeminiClient(api_key="stub", base_url=healthy_url, breaker=CircuitBreaker(2, 0.3))
+    client.retries, client.backoff = 2, 0.01
+    check("healthy call succeeds", calls(client, 1) == ["ok"], problems)
+    check("stream yields the ID line first", "".join(client.stream_generate(PAYLOAD)).startswith("B1\n"), problems)
+
+    client.base_url = failing_url
+    started = time.perf_counter()
+    outcomes = calls(client, 3)
+    check("503s are retried, then the breaker opens", outcomes == ["GeminiError", "GeminiError", "CircuitOpenError"], problems)
+    check("open breaker fails fast", time.perf_counter() - started < 1.0, problems)
+
+    time.sleep(0.35)
+    check("half-open trial failure re-opens", calls(client, 2) == ["GeminiError", "CircuitOpenError"], problems)
+
+    time.sleep(0.35)
+    client.base_url = healthy_url
+    check("half-open trial success closes", calls(client, 2) == ["ok", "ok"] and client.breaker.state == "closed", problems)
+
+    # A trial that dies on something other than an HTTP error must still settle the breaker
+    client.base_url = failing_url
+    calls(client, 2)
+    time.sleep(0.35)
+    request = client.session.request
+    client.session.request = lambda *a, **k: 1 / 0
+    try:
+        client.generate(PAYLOAD)
+    except ZeroDivisionError:
+        pass
+    client.session.request = request
+    time.sleep(0.35)
+    client.base_url = healthy_url
+    check("unexpected error in a trial doesn't wedge the breaker", calls(client, 1) == ["ok"], problems)
+
+    client.base_url, client.timeout, client.retries = slow_url, (1, 0.1), 0
+    started = time.perf_counter()
+    outcomes = calls(client, 1)
+    check("read deadline is enforced", outcomes == ["GeminiError"] and time.perf_counter() - started < 0.4, problems)
+    time.sleep(0.5)  # Let the slow stub finish its reply before shutting down
+
+    for server in (healthy, failing, slow):
+        server.shutdown()
+    if problems:
+        print(f"FAILED: {len(problems)} check(s)")
+        sys.exit(1)
+    print("OK: retries, deadlines, breaker and streaming behave")
+
+if __name__ == "__main__":
+    main()
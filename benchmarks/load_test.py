@@ -0,0 +1,287 @@
+"""
+Multi-terminal load test for the Raspberry2 server.
+N simulated terminals log in and then issue a weighted mix of actions
+against the real on_message -> dispatcher -> LibraryController -> SQLite
+path. Gemini is replaced by benchmarks/mock_gemini.py, and MQTT by an
+in-process broker (or a real one with --broker host:port).
+
+    python3 benchmarks/load_test.py --terminals 20 --duration 30 --rate 4
+    python3 benchmarks/load_test.py --mix scan=1,borrow=3,return=3 --gemini-latency 1.0
+    python3 benchmarks/load_test.py --wire msgpack
+    python3 benchmarks/load_test.py --mix chat=1 --gemini-latency 2.0 --no-stream
+
+Prints throughput and p50/p95/p99 latency per action. With streaming on,
+"chat (first chunk)" is the time until the first words of the reply arrive.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import queue
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, "Raspberry2"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import mock_gemini
+
+INTERESTS = ["Sci-Fi", "History", "Nature", "Mathematics", "Sports", "Poetry", "Cooking", "Travel"]
+DEFAULT_MIX = "scan=3,borrow=2,return=2,chat=1,get_logs=1"
+
+# --- IN-PROCESS MQTT STAND-IN ---
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class InProcessBroker:
+    """
+    Exact-topic pub/sub with paho-like clients. Every message is delivered
+    on one broker thread, the same way paho runs on_message on its network thread.
+    """
+    def __init__(self):
+        self.subscribers = defaultdict(list)
+        self.inbox = queue.Queue()
+        threading.Thread(target=self._deliver_loop, name="broker", daemon=True).start()
+
+    def client(self):
+        return InProcessClient(self)
+
+    def _deliver_loop(self):
+        while True:
+            topic, payload = self.inbox.get()
+            for client in list(self.subscribers.get(topic, [])):
+                if client.on_message:
+                    client.on_message(client, None, Message(topic, payload))
+
+class InProcessClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_message = None
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribers[topic].append(self)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.broker.inbox.put((topic, payload))
+
+def paho_client(host, port):
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.connect(host, port, 60)
+    client.loop_start()
+    return client
+
+# --- SIMULATED TERMINAL ---
+class Terminal:
+    def __init__(self, index, make_client, user_id, book_ids, mix, rate, timeout, stats, config, wire, fmt):
+        self.terminal_id = f"load-{index}"
+        self.user_id = user_id
+        self.book_ids = book_ids
+        self.actions, self.weights = zip(*mix.items())
+        self.rate = rate
+        self.timeout = timeout
+        self.stats = stats
+        self.config = config
+        self.wire = wire
+        self.fmt = fmt
+        self.token = None
+        self.held_book = None
+        self.corr_ids = itertools.count(1)
+        self.waiting = {}  # corr_id -> (event, [reply], expected reply type, label, start time)
+
+        self.client = make_client()
+        self.client.on_message = self.on_message
+        self.client.subscribe(config.reply_topic(self.terminal_id))
+
+    def on_message(self, client, userdata, msg):
+        data = self.wire.decode(msg.payload)
+        waiter = self.waiting.get(data.get("corr_id"))
+        if not waiter:
+            return
+        event, box, expect, label, started = waiter
+        if data.get("type") == "chat_chunk" and data.get("seq") == 0:
+            self.stats.record(f"{label} (first chunk)", time.perf_counter() - started, "ok")
+        if expect and data.get("type") != expect and data.get("status") != "error":
+            return  # e.g. the login reply before the AI recommendation
+        self.waiting.pop(data.get("corr_id"), None)
+        box.append(data)
+        event.set()
+
+    def request(self, label, payload, expect=None):
+        """Sends and waits for the first reply (or the first reply of type 'expect')"""
+        corr_id = next(self.corr_ids)
+        payload.update({"terminal": self.terminal_id, "corr_id": corr_id, "token": self.token})
+        event, box = threading.Event(), []
+        started = time.perf_counter()
+        self.waiting[corr_id] = (event, box, expect, label, started)
+        self.client.publish(self.wire.request_topic(self.fmt), self.wire.encode(payload, self.fmt))
+        if not event.wait(self.timeout):
+            self.waiting.pop(corr_id, None)
+            self.stats.record(label, None, "TIMEOUT")
+            return None
+        reply = box[0]
+        self.stats.record(label, time.perf_counter() - started, reply.get("code") or reply.get("status", "ok"))
+        return reply
+
+    def run(self, deadline):
+        reply = self.request("scan (login)", {"action": "scan", "id": self.user_id})
+        if reply:
+            self.token = reply.get("token")
+        while time.time() < deadline:
+            time.sleep(random.expovariate(self.rate))
+            action = random.choices(self.actions, self.weights)[0]
+            if action == "scan":
+                self.request("scan (book)", {"action": "scan", "id": random.choice(self.book_ids)})
+            elif action == "borrow":
+                book_id = random.choice(self.book_ids)
+                reply = self.request("borrow", {"action": "borrow", "book_id": book_id})
+                if reply and reply.get("status") == "success":
+                    self.held_book = book_id
+            elif action == "return":
+                reply = self.request("return", {"action": "return", "book_id": self.held_book or random.choice(self.book_ids)})
+                if reply and reply.get("status") == "success":
+                    self.held_book = None
+            elif action == "chat":
+                text = f"Something about {random.choice(INTERESTS)}"
+                self.request("chat", {"action": "chat", "text": text}, expect="chat_response")
+            elif action == "get_logs":
+                self.request("get_logs", {"action": "get_logs"})
+
+# --- REPORTING ---
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, seconds, outcome):
+        with self.lock:
+            if seconds is not None:
+                self.latencies[label].append(seconds)
+            self.outcomes[label][outcome] += 1
+
+    def report(self, duration):
+        def pct(values, p):
+            return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+        print(f"{'action':<20}{'count':>7}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  outcomes")
+        total = 0
+        for label in sorted(self.outcomes):
+            values = sorted(self.latencies[label])
+            count = sum(self.outcomes[label].values())
+            total += count
+            outcomes = ", ".join(f"{k}={v}" for k, v in sorted(self.outcomes[label].items()))
+            if values:
+                print(f"{label:<20}{count:>7}{count / duration:>8.1f}{pct(values, .5):>9.1f}"
+                      f"{pct(values, .95):>9.1f}{pct(values, .99):>9.1f}  {outcomes}")
+            else:
+                print(f"{label:<20}{count:>7}{count / duration:>8.1f}{'-':>9}{'-':>9}{'-':>9}  {outcomes}")
+        print(f"{'total':<20}{total:>7}{total / duration:>8.1f}")
+
+# --- SETUP ---
+def build_db(path, n_users, n_books):
+    import init_db
+    conn = sqlite3.connect(path)
+    init_db.create_schema(conn)
+    conn.executemany(
+        "INSERT INTO users (user_id, name, department, interest, role) VALUES (?, ?, 'Science', ?, 'client')",
+        ((f"LU{i}", f"Load User {i}", INTERESTS[i % len(INTERESTS)]) for i in range(n_users))
+    )
+    conn.executemany(
+        "INSERT INTO books (book_id, title, author, genre, description, status) VALUES (?, ?, 'Author', ?, ?, 'available')",
+        ((f"LB{i}", f"Book {i}", INTERESTS[i % len(INTERESTS)], f"A book about {INTERESTS[i % len(INTERESTS)]}.")
+         for i in range(n_books))
+    )
+    conn.commit()
+    conn.close()
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--terminals", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--rate", type=float, default=2, help="requests per second per terminal")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"action weights (default {DEFAULT_MIX})")
+    parser.add_argument("--books", type=int, default=200)
+    parser.add_argument("--gemini-latency", type=float, default=0.3)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--broker", help="host:port of a real broker (default: in-process)")
+    parser.add_argument("--timeout", type=float, default=15)
+    parser.add_argument("--wire", choices=["json", "msgpack"], default="json", help="terminal payload encoding")
+    parser.add_argument("--no-stream", action="store_true", help="AI replies in one piece (AI_STREAM=false)")
+    parser.add_argument("--verbose", action="store_true", help="show the server's console output")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    db_path = os.path.join(tmp.name, "load.db")
+    mock, mock_url = mock_gemini.start(latency=args.gemini_latency, error_rate=args.gemini_error_rate)
+
+    # The server reads these at import time, so set them before importing anything from it
+    os.environ.update({
+        "LIBRARY_DB": db_path,
+        "SESSION_FILE": os.path.join(tmp.name, "sessions.json"),
+        "GEMINI_BASE_URL": mock_url,
+        "GEMINI_API_KEY": "mock",
+        "AI_STREAM": "false" if args.no_stream else "true",
+    })
+    build_db(db_path, args.terminals, args.books)
+    quiet = contextlib.redirect_stdout(io.StringIO()) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        from common import config, wire
+        import main as server
+
+        if args.broker:
+            host, _, port = args.broker.partition(":")
+            make_client = lambda: paho_client(host, int(port or 1883))
+        else:
+            broker = InProcessBroker()
+            make_client = broker.client
+        server_client = make_client()
+        server_client.on_message = server.on_message
+        server_client.subscribe(config.TOPIC_SCAN)
+        server_client.subscribe(config.TOPIC_SCAN_BINARY)
+
+        stats = Stats()
+        mix = parse_mix(args.mix)
+        book_ids = [f"LB{i}" for i in range(args.books)]
+        terminals = [
+            Terminal(i, make_client, f"LU{i}", book_ids, mix, args.rate, args.timeout, stats, config, wire, args.wire)
+            for i in range(args.terminals)
+        ]
+        time.sleep(0.2)  # Let subscriptions settle on a real broker
+
+        deadline = time.time() + args.duration
+        threads = [threading.Thread(target=t.run, args=(deadline,), daemon=True) for t in terminals]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(args.duration + args.timeout + 5)
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+
+    print(f"{args.terminals} terminals, {args.rate}/s each, {elapsed:.1f}s, "
+          f"Gemini mock {args.gemini_latency * 1000:.0f}ms, {args.wire}")
+    stats.report(elapsed)
+    mock.shutdown()
+    tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
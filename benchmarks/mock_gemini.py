@@ -0,0 +1,99 @@
+"""
+Local stand-in for the Gemini REST API (no key, no internet).
+It answers generateContent by picking the first book ID in the prompt's
+catalog (for every interest of a precompute batch), after an optional
+delay and with an optional error rate. streamGenerateContent is answered
+as server-sent events: the ID line first, then the reason word by word,
+with the delay spread across the events.
+
+    python3 benchmarks/mock_gemini.py --port 8099 --latency 0.5
+    GEMINI_BASE_URL=http://127.0.0.1:8099 python3 main.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BOOK_ID = re.compile(r'"id": "([^"]+)"')
+REASON = "Mock pick from the shortlist."
+INTERESTS = re.compile(r'READER INTERESTS: (\[.*\])')
+
+def make_handler(latency, error_rate):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._send(200, {"models": [{"name": "models/mock-flash", "supportedGenerationMethods": ["generateContent"]}]})
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            stream = "streamGenerateContent" in self.path
+            if not stream:
+                time.sleep(latency)  # Streams spread it across their events instead
+            if random.random() < error_rate:
+                self._send(503, {"error": {"message": "mock overload"}})
+                return
+            prompt = body["contents"][0]["parts"][0]["text"]
+            match = BOOK_ID.search(prompt)
+            if stream:
+                self._stream([f"{match.group(1) if match else ''}\n"] + [w + " " for w in REASON.split()])
+                return
+            answer = {"id": match.group(1) if match else "", "reason": REASON}
+            interests = INTERESTS.search(prompt)
+            if interests:
+                # Batch prompt (precompute.py): the same pick for every interest
+                answer = {interest: [answer] for interest in json.loads(interests.group(1))}
+            self._send(200, {"candidates": [{"content": {"parts": [{"text": json.dumps(answer)}]}}]})
+
+        def _stream(self, pieces):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")  # Like the real API: one HTTP chunk per event
+            self.end_headers()
+            for piece in pieces:
+                time.sleep(latency / len(pieces))
+                event = {"candidates": [{"content": {"parts": [{"text": piece}]}}]}
+                raw = f"data: {json.dumps(event)}\r\n\r\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(raw), raw))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _send(self, status, data):
+            raw = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            try:
+                self.wfile.write(raw)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The client gave up (e.g. its read deadline passed)
+
+    return Handler
+
+def start(port=0, latency=0.0, error_rate=0.0):
+    """Starts the mock in a background thread. Returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(latency, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-gemini", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per generateContent call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that return 503")
+    args = parser.parse_args()
+    server, url = start(args.port, args.latency, args.error_rate)
+    print(f"Mock Gemini on {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
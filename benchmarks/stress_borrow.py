@@ -0,0 +1,119 @@
+"""
+Concurrency stress test for database.borrow_book / return_book.
+Many threads, each on its own SQLite connection (like separate server
+processes), fight over a few books. At the end every borrowed book must
+belong to exactly one user and the log must agree with the tables.
+
+    python3 benchmarks/stress_borrow.py --threads 16 --users 64 --books 8 --ops 500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, "Raspberry2"))
+import init_db
+import database
+
+def build_db(path, n_users, n_books):
+    conn = sqlite3.connect(path)
+    init_db.create_schema(conn)
+    conn.executemany(
+        "INSERT INTO users (user_id, name, department, role) VALUES (?, ?, 'Science', 'client')",
+        ((f"U{i}", f"User {i}") for i in range(n_users))
+    )
+    conn.executemany(
+        "INSERT INTO books (book_id, title, status) VALUES (?, ?, 'available')",
+        ((f"B{i}", f"Book {i}") for i in range(n_books))
+    )
+    conn.commit()
+    conn.close()
+
+def worker(path, users, books, ops, results):
+    conn = database.db_connect(path)
+    codes = Counter()
+    for _ in range(ops):
+        user_id = random.choice(users)
+        book_id = random.choice(books)
+        if random.random() < 0.5:
+            result = database.borrow_book(conn, user_id, book_id)
+        else:
+            result = database.return_book(conn, user_id, book_id)
+        codes[result.get("code", "OK")] += 1
+    conn.close()
+    results.append(codes)
+
+def check(path):
+    """Returns a list of invariant violations (empty = correct)"""
+    conn = sqlite3.connect(path)
+    problems = []
+    holders = conn.execute(
+        "SELECT current_book_id, COUNT(*) FROM users WHERE current_book_id IS NOT NULL GROUP BY current_book_id"
+    ).fetchall()
+    for book_id, count in holders:
+        if count > 1:
+            problems.append(f"{book_id} held by {count} users")
+    held = {book_id for book_id, _ in holders}
+    borrowed = {r[0] for r in conn.execute("SELECT book_id FROM books WHERE status='borrowed'")}
+    if held != borrowed:
+        problems.append(f"books marked borrowed {sorted(borrowed)} != books held {sorted(held)}")
+    for book_id, borrows, returns in conn.execute("""
+        SELECT book_id, SUM(action='borrowed'), SUM(action='returned') FROM log GROUP BY book_id
+    """):
+        expected = 1 if book_id in held else 0
+        if borrows - returns != expected:
+            problems.append(f"{book_id}: {borrows} borrows - {returns} returns in log, expected {expected}")
+    conn.close()
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--books", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="operations per thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.db")
+        build_db(path, args.users, args.books)
+        database.db_connect(path).close()  # Switch the file to WAL before the threads start
+
+        users = [f"U{i}" for i in range(args.users)]
+        books = [f"B{i}" for i in range(args.books)]
+        results = []
+        threads = [
+            threading.Thread(target=worker, args=(path, users, books, args.ops, results))
+            for _ in range(args.threads)
+        ]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        total = args.threads * args.ops
+        codes = sum(results, Counter())
+        print(f"{total} borrow/return calls from {args.threads} threads in {elapsed:.2f}s "
+              f"({total / elapsed:.0f} ops/s)")
+        for code, count in codes.most_common():
+            print(f"  {code:<18} {count}")
+
+        problems = check(path)
+        if problems:
+            print("FAILED:")
+            for problem in problems:
+                print(f"  {problem}")
+            sys.exit(1)
+        print("OK: no double borrows, tables and log agree")
+
+if __name__ == "__main__":
+    main()
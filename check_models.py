@@ -1,27 +1,20 @@
-import os
-import requests
-from dotenv import load_dotenv
+from common import config
+from common.gemini_client import GeminiClient, GeminiError
 
-# Load your API Key
-load_dotenv()
-API_KEY = os.getenv("GEMINI_API_KEY")
-
-if not API_KEY:
+if not config.GEMINI_KEY:
     print("❌ Error: API Key not found in .env")
     exit()
 
-# Ask Google for the list of available models
-url = f"https://generativelanguage.googleapis.com/v1beta/models?key={API_KEY}"
-response = requests.get(url)
-
-if response.status_code == 200:
+# Ask Google for the list of available models (same client the server uses)
+try:
+    models = GeminiClient().list_models()
+except GeminiError as e:
+    print(f"❌ Connection Error: {e}")
+else:
     print("\n✅ AVAILABLE MODELS FOR YOUR KEY:")
-    data = response.json()
-    for model in data.get('models', []):
+    for model in models:
         # Only show models that can generate text
         if "generateContent" in model.get('supportedGenerationMethods', []):
             # Print the clean name (removing "models/" prefix)
             clean_name = model['name'].replace("models/", "")
             print(f"  👉 {clean_name}")
-else:
-    print(f"❌ Connection Error: {response.text}")
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load .env from the current working directory or parent
@@ -9,14 +10,141 @@ load_dotenv()
 # If separate, use the Server's IP (e.g., "192.168.1.X")
 MQTT_BROKER = os.getenv("MQTT_BROKER", "localhost")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+# Reconnect backoff: starts at MIN seconds, doubles after each failed attempt, capped at MAX
+MQTT_RECONNECT_MIN = int(os.getenv("MQTT_RECONNECT_MIN", 1))
+MQTT_RECONNECT_MAX = int(os.getenv("MQTT_RECONNECT_MAX", 60))
 
 # --- TOPICS ---
 TOPIC_SCAN = "library/scan"       # Client -> Server
-TOPIC_DISPLAY = "library/display" # Server -> Client
+TOPIC_DISPLAY = "library/display" # Server -> All clients (broadcast only)
+TOPIC_SCAN_BINARY = f"{TOPIC_SCAN}/mp"  # Same requests, MessagePack-encoded (see common/wire.py)
+TOPIC_CATALOG = "library/catalog"              # Server -> All clients (retained full snapshot)
+TOPIC_CATALOG_DELTA = "library/catalog/delta"  # Server -> All clients (retained, latest change)
+
+# "json" (default) or "msgpack" (needs: pip3 install msgpack); replies come back in the same format
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json")
+
+# Each terminal gets its replies on library/display/<TERMINAL_ID>
+TERMINAL_ID = os.getenv("TERMINAL_ID", socket.gethostname())
+
+def reply_topic(terminal_id):
+    return f"{TOPIC_DISPLAY}/{terminal_id}"
+
+# --- TERMINAL UI ---
+# Inbound MQTT messages are applied to the Tk window once per frame (ms)
+UI_FRAME_MS = int(os.getenv("UI_FRAME_MS", 16))
+
+# --- RFID READER ---
+# "auto" (MFRC522 on a Pi, none elsewhere), "mfrc522", "replay" or "none"
+RFID_BACKEND = os.getenv("RFID_BACKEND", "auto").lower()
+RFID_REPLAY_FILE = os.getenv("RFID_REPLAY_FILE", "")  # CSV of: seconds_since_start,card_id
+RFID_POLL_INTERVAL = float(os.getenv("RFID_POLL_INTERVAL", 0.05))  # seconds between reads
+# The same card is ignored until it has been away from the reader this long
+RFID_DEBOUNCE = float(os.getenv("RFID_DEBOUNCE", 1.5))  # seconds
 
 # --- DATABASE ---
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, "raspberry2", "library.db")
+DB_PATH = os.getenv("LIBRARY_DB", os.path.join(BASE_DIR, "raspberry2", "library.db"))
+
+# Prepared statements kept per SQLite connection
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", 128))
+
+# How often the server checks for catalog edits made outside it (seconds)
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", 5))
+# Card IDs that matched nothing are answered from memory this long before SQLite is asked again
+UNKNOWN_CARD_TTL = float(os.getenv("UNKNOWN_CARD_TTL", 10))  # seconds
+# The retained catalog snapshot is re-published after this many deltas
+CATALOG_SNAPSHOT_EVERY = int(os.getenv("CATALOG_SNAPSHOT_EVERY", 20))
+# Terminal's local copy of the catalog (book scans are shown from it without a round trip)
+CATALOG_CACHE_FILE = os.getenv("CATALOG_CACHE_FILE", os.path.join(BASE_DIR, "raspberry1", "catalog.json"))
+# Changes are written to that file by a background thread at most this often (seconds)
+CATALOG_SAVE_INTERVAL = float(os.getenv("CATALOG_SAVE_INTERVAL", 5))
+
+# --- TERMINAL OUTBOX ---
+# Borrow/return requests wait here until the broker acknowledges them
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(BASE_DIR, "raspberry1", "outbox.db"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", 20))  # Replayed per round trip after a reconnect
+
+# --- SESSIONS ---
+SESSION_TTL = float(os.getenv("SESSION_TTL", 900))  # Idle seconds before logout
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 30))
+# Snapshot so a server restart doesn't log every terminal out
+SESSION_FILE = os.getenv("SESSION_FILE", os.path.join(BASE_DIR, "raspberry2", "sessions.json"))
+
+# --- ACTIVITY LOG ---
+# Log rows are written in one transaction per batch (or per interval)
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 50))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1.0))  # seconds
+# Admin log viewer: rows per page, and how often new rows are pushed to open viewers
+LOG_PAGE_SIZE = int(os.getenv("LOG_PAGE_SIZE", 50))
+LOG_PAGE_MAX = 500
+# Rows the admin log table keeps; pages scrolled far out of view are dropped and re-fetched
+LOG_VIEW_MAX = int(os.getenv("LOG_VIEW_MAX", 500))
+LOG_PUSH_INTERVAL = float(os.getenv("LOG_PUSH_INTERVAL", 1.0))  # seconds
 
 # --- API KEYS ---
-GEMINI_KEY = os.getenv("GEMINI_API_KEY")
\ No newline at end of file
+GEMINI_KEY = os.getenv("GEMINI_API_KEY")
+
+# --- GEMINI CLIENT ---
+# Point GEMINI_BASE_URL at a local stub server to test without the real API
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", 3))  # seconds
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", 20))      # seconds
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", 2))
+GEMINI_BACKOFF = float(os.getenv("GEMINI_BACKOFF", 0.5))  # base delay, doubles per retry
+# After this many failed calls in a row, skip Gemini for GEMINI_BREAKER_RESET seconds
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", 5))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", 30))
+
+# --- REQUEST DEDUP ---
+# msg_ids of handled borrow/return requests are kept in the DB this long
+# (terminals replay their outbox after an outage or restart)
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", 86400))  # seconds
+
+# --- SERVER WORKERS ---
+# Messages from the same user always run on the same worker (keeps them in order)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", 4))
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", 100))
+# How long the MQTT thread waits for a full worker before answering "Server busy"
+DISPATCH_SUBMIT_TIMEOUT = float(os.getenv("DISPATCH_SUBMIT_TIMEOUT", 2))
+
+# --- AI WORKERS ---
+# Fixed pool for Gemini calls; identical prompts in flight share one call
+AI_WORKERS = int(os.getenv("AI_WORKERS", 2))
+AI_QUEUE_SIZE = int(os.getenv("AI_QUEUE_SIZE", 20))
+
+# --- AI CACHE ---
+# Recommendations are reused until the catalog changes or the TTL runs out
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", 256))
+AI_CACHE_TTL = float(os.getenv("AI_CACHE_TTL", 3600))  # seconds
+
+# --- AI PROMPT ---
+# Only the top matches (BM25 over title/author/genre/description) go into the prompt
+AI_SHORTLIST_SIZE = int(os.getenv("AI_SHORTLIST_SIZE", 20))
+
+# --- AI STREAMING ---
+# Stream Gemini's answer: the reason reaches the terminal as numbered chat_chunk messages
+AI_STREAM = os.getenv("AI_STREAM", "true").lower() in ("1", "true", "yes")
+
+# --- PRECOMPUTED RECOMMENDATIONS (Raspberry2/precompute.py) ---
+PRECOMPUTE_BATCH = int(os.getenv("PRECOMPUTE_BATCH", 10))  # Interests per Gemini request
+PRECOMPUTE_TOP = int(os.getenv("PRECOMPUTE_TOP", 3))      # Picks stored per interest
+# With a precomputed pick, also ask Gemini live at login and send its answer when ready
+AI_REFINE_ON_LOGIN = os.getenv("AI_REFINE_ON_LOGIN", "false").lower() in ("1", "true", "yes")
+
+# --- METRICS ---
+TOPIC_METRICS = "library/metrics"  # Server -> dashboards (JSON snapshot)
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", 15))  # seconds
+# Prometheus text format (e.g. for node_exporter's textfile collector); empty = off
+METRICS_FILE = os.getenv("METRICS_FILE", os.path.join(BASE_DIR, "raspberry2", "metrics.prom"))
+
+# --- SERVER CONSOLE LOG ---
+# Written by a background thread (see common/logger.py), not by the MQTT/worker threads
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")  # DEBUG shows full payloads
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json" (one object per line)
+LOG_FILE = os.getenv("LOG_FILE", "")  # Rotating copy of the console output; empty = console only
+# Per-action overrides, e.g. "get_logs=WARNING,chat=DEBUG"
+LOG_ACTION_LEVELS = os.getenv("LOG_ACTION_LEVELS", "")
+# Fraction of per-request INFO/DEBUG lines kept, e.g. "scan=0.1,borrow=0.5" (warnings/errors always kept)
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
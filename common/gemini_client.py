@@ -0,0 +1,186 @@
+import json
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from common import config
+from common.metrics import metrics
+
+metrics.describe("library_gemini_seconds", "Gemini HTTP call duration (including retries)")
+metrics.describe("library_gemini_requests_total", "Gemini calls by outcome (ok, error, circuit_open)")
+metrics.describe("library_gemini_retries_total", "Gemini calls retried after a failure")
+
+# Worth retrying: rate limits and upstream hiccups
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class GeminiError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class CircuitOpenError(GeminiError):
+    """Raised without touching the network while Gemini is marked unhealthy"""
+
+class CircuitBreaker:
+    """
+    closed    -> calls go through; N failures in a row open the circuit
+    open      -> calls fail fast until reset_timeout has passed
+    half-open -> one trial call; success closes, failure re-opens
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+class GeminiClient:
+    """
+    Shared HTTP layer for the Gemini REST API.
+    Keeps connections alive, applies connect/read deadlines, retries with
+    jittered exponential backoff and fails fast while the circuit is open.
+    base_url can point at a local stub server for testing.
+    """
+    def __init__(self, api_key=None, base_url=None, model=None, breaker=None):
+        self.api_key = api_key if api_key is not None else config.GEMINI_KEY
+        self.base_url = (base_url or config.GEMINI_BASE_URL).rstrip("/")
+        self.model = model or config.GEMINI_MODEL
+        self.timeout = (config.GEMINI_CONNECT_TIMEOUT, config.GEMINI_READ_TIMEOUT)
+        self.retries = config.GEMINI_RETRIES
+        self.backoff = config.GEMINI_BACKOFF
+        self.breaker = breaker or CircuitBreaker(config.GEMINI_BREAKER_FAILURES, config.GEMINI_BREAKER_RESET)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(config.AI_WORKERS, 2))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Key goes in a header so it never shows up in URLs or error logs
+        self.session.headers.update({"Content-Type": "application/json", "x-goog-api-key": self.api_key or ""})
+
+    def generate(self, payload):
+        """POST :generateContent and return the decoded JSON body"""
+        return self._request("POST", f"/models/{self.model}:generateContent", json=payload).json()
+
+    def stream_generate(self, payload):
+        """
+        POST :streamGenerateContent (server-sent events) and yield the text
+        of each part as it arrives. Retries only happen before the first byte.
+        The call only counts as a success (breaker, metrics) once the stream is
+        drained; breaking off mid-body counts as a failure.
+        """
+        started = time.perf_counter()
+        response = self._request("POST", f"/models/{self.model}:streamGenerateContent",
+                                 params={"alt": "sse"}, json=payload, stream=True, settle=False)
+        response.encoding = "utf-8"  # SSE is always UTF-8 (requests would guess ISO-8859-1 for text/*)
+        outcome = "error"
+        try:
+            # chunk_size=None: hand over each chunk as it arrives instead of waiting for 512 bytes
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                for candidate in event.get("candidates", [])[:1]:
+                    for part in candidate.get("content", {}).get("parts", []):
+                        if part.get("text"):
+                            yield part["text"]
+            outcome = "ok"
+        except (requests.RequestException, ValueError) as e:
+            raise GeminiError(f"Stream broken: {type(e).__name__}: {e}")
+        except GeneratorExit:
+            outcome = "ok"  # The caller stopped reading early; upstream was fine
+            raise
+        finally:
+            response.close()
+            self._settle(outcome, started)
+
+    def list_models(self):
+        return self._request("GET", "/models").json().get("models", [])
+
+    def _request(self, method, path, settle=True, **kwargs):
+        """settle=False: a 200 isn't final yet; the caller reports the outcome with _settle()"""
+        if not self.breaker.allow():
+            metrics.inc("library_gemini_requests_total", outcome="circuit_open")
+            raise CircuitOpenError("Gemini circuit open (recent failures), skipping call")
+
+        started = time.perf_counter()
+        try:
+            response = self._send(method, path, settle, **kwargs)
+        except Exception as e:
+            if not isinstance(e, GeminiError):
+                # Unexpected error: still settle the breaker, or a half-open trial would never end
+                self.breaker.record_failure()
+            metrics.inc("library_gemini_requests_total", outcome="error")
+            metrics.observe("library_gemini_seconds", time.perf_counter() - started, outcome="error")
+            raise
+        if settle:
+            metrics.inc("library_gemini_requests_total", outcome="ok")
+            metrics.observe("library_gemini_seconds", time.perf_counter() - started, outcome="ok")
+        return response
+
+    def _settle(self, outcome, started):
+        """Final outcome of a call made with settle=False (e.g. once a stream is drained)"""
+        if outcome == "ok":
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        metrics.inc("library_gemini_requests_total", outcome=outcome)
+        metrics.observe("library_gemini_seconds", time.perf_counter() - started, outcome=outcome)
+
+    def _send(self, method, path, settle=True, **kwargs):
+        url = self.base_url + path
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+                if response.status_code == 200:
+                    if settle:
+                        self.breaker.record_success()
+                    return response
+                error = GeminiError(f"HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+                if response.status_code not in RETRY_STATUS:
+                    # Bad request / bad key: upstream is fine, retrying won't help
+                    self.breaker.record_success()
+                    raise error
+            except requests.RequestException as e:
+                error = GeminiError(f"{type(e).__name__}: {e}")
+
+            if attempt < self.retries:
+                metrics.inc("library_gemini_retries_total")
+                # Full jitter so AI workers don't retry in lockstep
+                time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+        self.breaker.record_failure()
+        raise error
@@ -0,0 +1,120 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from common import config
+
+# Every LogRecord has these; anything else came in through extra= and is a structured field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+ROOT = "library"
+_listener = None
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread untouched.
+    The stdlib version formats the message in prepare(), i.e. on the calling
+    thread; here the %-args are only merged when the record is written out.
+    Pass values, not objects the caller mutates afterwards.
+    """
+    def prepare(self, record):
+        return record
+
+class StructuredFormatter(logging.Formatter):
+    """'time LEVEL logger: message key=value ...', or one JSON object per line"""
+    def __init__(self, as_json=False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.as_json = as_json
+
+    def format(self, record):
+        if not self.as_json:
+            return super().format(record)
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **_fields(record)
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        fields = _fields(record)
+        if fields:
+            text += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return text
+
+class SampleFilter(logging.Filter):
+    """Keeps a fraction of records below WARNING; warnings and errors always pass"""
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+def get_logger(name):
+    """Logger under the 'library' tree, e.g. get_logger("ai") -> library.ai"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+def action_logger(action):
+    """Per-MQTT-action logger (library.action.<action>), with its own level and sampling"""
+    return get_logger(f"action.{action or 'unknown'}")
+
+def setup_logging():
+    """
+    Routes the 'library' loggers through a queue to one background thread,
+    so callers never wait on console or SD-card writes. Safe to call twice.
+    """
+    global _listener
+    if _listener:
+        return _listener
+
+    root = logging.getLogger(ROOT)
+    root.setLevel(config.LOG_LEVEL.upper())
+    root.propagate = False
+
+    formatter = StructuredFormatter(config.LOG_FORMAT == "json")
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if config.LOG_FILE:
+        handlers.append(logging.handlers.RotatingFileHandler(config.LOG_FILE, maxBytes=1_000_000, backupCount=3))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    for handler in [h for h in root.handlers if isinstance(h, LazyQueueHandler)]:
+        root.removeHandler(handler)  # Left over from an earlier setup/shutdown
+    root.addHandler(LazyQueueHandler(records))
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    # e.g. LOG_ACTION_LEVELS="get_logs=WARNING,chat=DEBUG"  LOG_SAMPLE="scan=0.1"
+    for action, level in _pairs(config.LOG_ACTION_LEVELS):
+        action_logger(action).setLevel(level.upper())
+    for action, rate in _pairs(config.LOG_SAMPLE):
+        action_logger(action).addFilter(SampleFilter(float(rate)))
+    return _listener
+
+def shutdown_logging():
+    """Writes out whatever is still queued and stops the listener thread"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+def _fields(record):
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+def _pairs(text):
+    for part in (text or "").split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            yield name.strip(), value.strip()
@@ -0,0 +1,177 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Latency buckets in seconds (1ms .. 10s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Size buckets (rows per batch, items per request...)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot = above the largest bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-th observation
+        (the largest bound if it is above all of them, so the result stays valid JSON)
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+class Metrics:
+    """
+    Process-wide counters, latency histograms and sampled gauges.
+    Exported as a JSON snapshot (for MQTT) or Prometheus text format.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}      # name -> function returning the current value
+        self.sampled = {}     # name -> function returning a running total kept elsewhere
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """Adds value (seconds, unless other buckets such as SIZE_BUCKETS are given) to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def gauge(self, name, func, text=None):
+        """func() is called at export time (queue depths, session counts...)"""
+        self.gauges[name] = func
+        if text:
+            self.help[name] = text
+
+    def counter(self, name, func, text=None):
+        """Like gauge(), for totals that only go up (e.g. a cache's own hit count)"""
+        self.sampled[name] = func
+        if text:
+            self.help[name] = text
+
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name, **labels):
+        """Decorator: observes every call's duration, labelled with the function name"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name, query=func.__name__, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _gauge_values(self, funcs=None):
+        values = {}
+        for name, func in list((self.gauges if funcs is None else funcs).items()):
+            try:
+                values[name] = func()
+            except Exception:
+                values[name] = None
+        return values
+
+    def snapshot(self):
+        """JSON-friendly view: counters, histogram summaries (ms for latencies) and gauges"""
+        with self.lock:
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                counters.setdefault(name, {})[_label_str(labels)] = value
+            for name, value in self._gauge_values(self.sampled).items():
+                counters.setdefault(name, {})["all"] = value
+            histograms = {}
+            for (name, labels), hist in self.histograms.items():
+                scale, unit = (1000, "_ms") if hist.buckets is DEFAULT_BUCKETS else (1, "")
+                histograms.setdefault(name, {})[_label_str(labels)] = {
+                    "count": hist.count,
+                    f"avg{unit}": round(hist.sum / hist.count * scale, 2) if hist.count else 0.0,
+                    f"p50{unit}": hist.quantile(0.5) * scale,
+                    f"p95{unit}": hist.quantile(0.95) * scale,
+                    f"p99{unit}": hist.quantile(0.99) * scale
+                }
+        return {"time": time.time(), "counters": counters, "histograms": histograms, "gauges": self._gauge_values()}
+
+    def render_prometheus(self):
+        lines = []
+        def header(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            for name in sorted({n for n, _ in self.counters}):
+                header(name, "counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_prom_labels(labels)} {value}")
+            for name, value in sorted(self._gauge_values(self.sampled).items()):
+                if value is not None:
+                    header(name, "counter")
+                    lines.append(f"{name} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                header(name, "histogram")
+                for (n, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_prom_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_prom_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{name}_sum{_prom_labels(labels)} {hist.sum:.6f}")
+                    lines.append(f"{name}_count{_prom_labels(labels)} {hist.count}")
+        for name, value in sorted(self._gauge_values().items()):
+            if value is None:
+                continue
+            header(name, "gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+def _label_str(labels):
+    return ",".join(f"{k}={v}" for k, v in labels) or "all"
+
+def _prom_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+# Shared registry for the whole process
+metrics = Metrics()
@@ -0,0 +1,68 @@
+"""
+MQTT payload encoding.
+
+JSON is the default and what every client understands. Terminals with
+msgpack installed can publish on TOPIC_SCAN_BINARY instead; the server then
+answers that request in MessagePack, with list-of-dict fields (the log
+rows) sent column by column so the keys go over the wire once.
+decode() tells the two apart by the first byte, so either side can
+receive both.
+"""
+import json
+
+from common import config
+
+try:
+    import msgpack
+except ImportError:  # Optional: JSON only
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Sent as columns in binary mode: {"columns": [...], "values": [[col 0], [col 1], ...]}
+COLUMNAR_FIELDS = ("logs",)
+
+def available(fmt):
+    return fmt == JSON or (fmt == MSGPACK and msgpack is not None)
+
+def client_format():
+    """The format this terminal asks for (falls back to JSON without msgpack)"""
+    fmt = config.WIRE_FORMAT.lower()
+    return fmt if available(fmt) else JSON
+
+def request_topic(fmt):
+    return config.TOPIC_SCAN_BINARY if fmt == MSGPACK else config.TOPIC_SCAN
+
+def topic_format(topic):
+    """Format a request asked for, from the topic it came in on"""
+    return MSGPACK if topic == config.TOPIC_SCAN_BINARY and msgpack is not None else JSON
+
+def encode(data, fmt=JSON):
+    if fmt != MSGPACK:
+        return json.dumps(data)
+    columnar = [key for key in COLUMNAR_FIELDS if isinstance(data.get(key), list)]
+    if columnar:
+        data = dict(data)
+        for key in columnar:
+            data[key] = to_columns(data[key])
+        data["_columnar"] = columnar
+    return msgpack.packb(data, use_bin_type=True)
+
+def decode(raw):
+    """bytes -> dict, whichever format the sender used"""
+    if raw[:1] in (b"{", b" ", b"\n") or msgpack is None:
+        return json.loads(raw.decode() if isinstance(raw, bytes) else raw)
+    data = msgpack.unpackb(raw, raw=False)
+    for key in data.pop("_columnar", ()):
+        data[key] = from_columns(data[key])
+    return data
+
+def to_columns(rows):
+    """[{a: 1, b: 2}, {a: 3, b: 4}] -> {"columns": [a, b], "values": [[1, 3], [2, 4]]}"""
+    columns = list(rows[0]) if rows else []
+    return {"columns": columns, "values": [[row.get(col) for row in rows] for col in columns]}
+
+def from_columns(table):
+    columns = table["columns"]
+    return [dict(zip(columns, values)) for values in zip(*table["values"])]